@@ -0,0 +1,177 @@
+"""
+Замеры производительности для примера паттерна Фасад.
+
+Запуск из директории паттерна: python benchmark.py
+"""
+import os
+import random
+import resource
+import time
+from multiprocessing import Process, Queue
+from tempfile import TemporaryDirectory
+
+from example import CodecPool, ConversionCache, PipelineMetrics, VideoConverter
+
+
+def make_file(path, size):
+    """Создает разреженный файл заданного размера - место на диске почти не занимается."""
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def peak_rss():
+    """Пиковый размер резидентной памяти процесса в МБ (Linux отдает его в КБ)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_streaming(sizes=(2 ** 30, 2 * 2 ** 30, 4 * 2 ** 30), whole_size=256 * 2 ** 20):
+    """
+    Потоковая конвертация многогигабайтных файлов держит память на одном уровне.
+
+    Пиковая память процесса только растет, поэтому сначала замеряется
+    потоковый путь, а конвертация целиком - в конце и на файле поменьше.
+    """
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input.mp4')
+        with open(os.devnull, 'wb') as sink:
+            for size in sizes:
+                make_file(path, size)
+                start = time.perf_counter()
+                written = VideoConverter.convert_to(path, sink)
+                assert written == size
+                print('streaming: {0:.0f} ГБ за {1:.1f} c, пиковая память {2:.0f} МБ'.format(
+                    size / 2 ** 30, time.perf_counter() - start, peak_rss(),
+                ))
+
+        make_file(path, whole_size)
+        result = VideoConverter.convert(path)
+        assert len(result) == whole_size
+        print('whole: {0:.0f} МБ целиком, пиковая память {1:.0f} МБ'.format(whole_size / 2 ** 20, peak_rss()))
+
+
+def bench_convert_many(files=200, max_size=4 * 2 ** 20):
+    """Замеряет пропускную способность convert_many от 1 до os.cpu_count() процессов."""
+    rnd = random.Random(0)
+    with TemporaryDirectory() as directory:
+        filenames = []
+        for i in range(files):
+            filename = os.path.join(directory, '{0}.mp4'.format(i))
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(rnd.randrange(max_size)))
+            filenames.append(filename)
+        filenames.append(os.path.join(directory, 'missing.mp4'))
+        total = sum(os.path.getsize(filename) for filename in filenames[:-1])
+
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            errors = sum(1 for result in VideoConverter.convert_many(filenames, workers=workers) if result.error)
+            elapsed = time.perf_counter() - start
+            assert errors == 1
+            print('convert_many: {0} процессов - {1:.0f} МБ/с'.format(workers, total / 2 ** 20 / elapsed))
+            workers *= 2
+
+
+def _first_byte(path, streaming, use_mmap, queue):
+    start = time.perf_counter()
+    if streaming:
+        chunks = VideoConverter.convert_stream(path, mmap=use_mmap)
+        first = next(chunks)
+        ttfb = time.perf_counter() - start
+        written = len(first) + sum(len(chunk) for chunk in chunks)
+    else:
+        result = VideoConverter.convert(path, mmap=use_mmap)
+        ttfb = time.perf_counter() - start
+        written = len(result)
+    queue.put((ttfb, written, peak_rss()))
+
+
+def bench_mmap(size=2 ** 30):
+    """
+    Сравнивает чтение через read и через mmap на одном и том же пути.
+
+    Для convert и convert_stream замеряются время до первого байта и
+    пиковая память с mmap=False и mmap=True.
+    """
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input.mp4')
+        with open(path, 'wb') as f:
+            chunk = os.urandom(2 ** 20)
+            for _ in range(size // len(chunk)):
+                f.write(chunk)
+
+        for streaming in (False, True):
+            for use_mmap in (False, True):
+                # Каждый замер в отдельном процессе, т.к. пиковая память процесса только растет.
+                queue = Queue()
+                process = Process(target=_first_byte, args=(path, streaming, use_mmap, queue))
+                process.start()
+                ttfb, written, rss = queue.get()
+                process.join()
+                assert written == size
+                print('{0} mmap={1}: первый байт через {2:.4f} c, пиковая память {3:.0f} МБ'.format(
+                    'convert_stream' if streaming else 'convert', use_mmap, ttfb, rss,
+                ))
+
+
+def bench_cache(files=20, size=16 * 2 ** 20, requests=200):
+    """Повторные конвертации одних и тех же файлов через кэш."""
+    rnd = random.Random(0)
+    with TemporaryDirectory() as directory:
+        filenames = []
+        for i in range(files):
+            filename = os.path.join(directory, '{0}.mp4'.format(i))
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(size))
+            filenames.append(filename)
+
+        cache = ConversionCache(os.path.join(directory, 'cache'), max_bytes=files // 2 * size)
+        start = time.perf_counter()
+        for _ in range(requests):
+            VideoConverter.convert(rnd.choice(filenames), cache=cache)
+        print('cache: {0} конвертаций за {1:.2f} c, попаданий {2:.0%}, сэкономлено {3:.0f} МБ'.format(
+            requests, time.perf_counter() - start, cache.hit_rate, cache.bytes_saved / 2 ** 20,
+        ))
+
+
+def bench_codec_pool(calls=200, size=64 * 2 ** 10):
+    """Сравнивает задержку конвертации маленьких файлов с пулом кодеков и без него."""
+    with TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'small.mp4')
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(size))
+
+        start = time.perf_counter()
+        pool = CodecPool(size=2)
+        print('pool: прогрев за {0:.3f} c'.format(time.perf_counter() - start))
+        for title, kwargs in (('без пула', {}), ('с пулом', {'pool': pool})):
+            start = time.perf_counter()
+            for _ in range(calls):
+                VideoConverter.convert(filename, **kwargs)
+            print('pool: {0} - {1:.3f} мс на вызов'.format(title, (time.perf_counter() - start) / calls * 1000))
+
+
+def bench_metrics(calls=1000, size=64 * 2 ** 10):
+    """Замеряет накладные расходы сбора метрик этапов."""
+    with TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'small.mp4')
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(size))
+
+        pool = CodecPool(size=1)
+        metrics = PipelineMetrics()
+        for title, kwargs in (('без метрик', {}), ('с метриками', {'metrics': metrics})):
+            start = time.perf_counter()
+            for _ in range(calls):
+                VideoConverter.convert(filename, pool=pool, **kwargs)
+            print('metrics: {0} - {1:.4f} мс на вызов'.format(title, (time.perf_counter() - start) / calls * 1000))
+        print(metrics.to_prometheus(), end='')
+
+
+if __name__ == '__main__':
+    bench_streaming()
+    bench_convert_many()
+    bench_mmap()
+    bench_cache()
+    bench_codec_pool()
+    bench_metrics()
@@ -1,3 +1,22 @@
+import mmap as mmap_module
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from queue import Empty, Queue
+from threading import Lock
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+CHUNK_SIZE = 1024 * 1024
+CODEC_BUFFER_SIZE = 16 * 1024 * 1024
+
+ConversionResult = namedtuple('ConversionResult', 'filename result error')
+
+
 class VideoFile:
     """
     Классы подсистемы.
@@ -12,26 +31,352 @@ class VideoFile:
 
 
 class MPEG4CompressionCodec:
-    pass
+    def __init__(self, **params):
+        # Настройка кодека дорогая: загрузка таблиц, выделение рабочих буферов.
+        self.params = params
+        self._work_buffer = bytearray(CODEC_BUFFER_SIZE)
+
+    def encode(self, data):
+        return bytes(data)
 
 
 class OggCompressionCodec:
-    pass
+    def __init__(self, **params):
+        self.params = params
+        self._work_buffer = bytearray(CODEC_BUFFER_SIZE)
+
+    def encode(self, data):
+        return bytes(data)
 
 
 class BitrateReader:
     @staticmethod
     def read(file):
-        return ''
+        with open(file.filename, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def map(file) -> memoryview:
+        """
+        Отображает файл в память и возвращает memoryview только для чтения.
+
+        Данные не копируются в память процесса: страницы файла подгружаются
+        операционной системой по мере обращения к ним, а срезы memoryview
+        тоже не копируют данные.
+        """
+        with open(file.filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b'')
+            return memoryview(mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ))
 
     @staticmethod
     def convert(buffer, codec):
-        return ''
+        """
+        Конвертирует буфер целиком и возвращает bytearray.
+
+        Кодек получает буфер срезами по CHUNK_SIZE и пишет результат в
+        заранее выделенный bytearray размером со вход, поэтому входной буфер
+        целиком не копируется. Для отображенного файла (memoryview из map)
+        обработанные страницы отдаются системе, и в памяти остается только
+        результат.
+        """
+        view = memoryview(buffer)
+        result = bytearray(len(view))
+        position = 0
+        for chunk in BitrateReader.convert_chunks(BitrateReader._slices(view, CHUNK_SIZE), codec):
+            # Если размер части после кодека изменился, bytearray подстроится.
+            result[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        del result[position:]
+        return result
+
+    @staticmethod
+    def _slices(view: memoryview, chunk_size) -> Iterator[memoryview]:
+        """Срезы буфера; страницы отображенного файла после обработки отдаются системе (MADV_DONTNEED)."""
+        mapping = view.obj
+        release = hasattr(mapping, 'madvise') and hasattr(mmap_module, 'MADV_DONTNEED') \
+            and chunk_size % mmap_module.PAGESIZE == 0
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+            if release:
+                mapping.madvise(mmap_module.MADV_DONTNEED, offset, min(chunk_size, len(view) - offset))
+
+    @staticmethod
+    def read_chunks(file, chunk_size=CHUNK_SIZE, mmap=False) -> Iterator[Union[bytes, memoryview]]:
+        """
+        Читает файл частями по chunk_size байт.
+
+        При mmap=True части - это срезы memoryview над отображенным файлом.
+        Обработанные страницы отдаются обратно системе (MADV_DONTNEED), чтобы
+        память процесса не росла с размером файла; при повторном обращении
+        они снова прочитаются из файла.
+        """
+        if mmap:
+            yield from BitrateReader._slices(BitrateReader.map(file), chunk_size)
+            return
+
+        with open(file.filename, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    @staticmethod
+    def convert_chunks(chunks: Iterable[bytes], codec) -> Iterator[bytes]:
+        for chunk in chunks:
+            yield codec.encode(chunk)
 
 
 class AudioMixer:
     def fix(self, result):
-        return ''
+        return result
+
+    def fix_chunks(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            yield self.fix(chunk)
+
+
+class ConversionCache:
+    """
+    Дисковый кэш результатов конвертации.
+
+    Результат хранится в файле, имя которого - хэш содержимого исходного
+    файла, формата и параметров кодека, поэтому одинаковые файлы под
+    разными именами попадают в одну запись. Запись пишется во временный
+    файл и атомарно переименовывается. Когда общий размер записей
+    превышает max_bytes, удаляются давно не использованные.
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def key(filename, format, codec_class: type, params: Optional[Dict[str, Any]] = None) -> str:
+        """Ключ записи; кодек для него не создается - достаточно его класса и параметров."""
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        params = sorted((params or {}).items())
+        digest.update('|{0}|{1}|{2!r}'.format(format, codec_class.__name__, params).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key) -> Optional[bytearray]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                # bytearray, как и у результата конвертации без кэша.
+                result = bytearray(os.fstat(f.fileno()).st_size)
+                f.readinto(result)
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(result)
+        return result
+
+    def put(self, key, result: Union[bytes, bytearray]):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(result)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self._size += len(result) - self._entries.pop(key, 0)
+            self._entries[key] = len(result)
+            while self._size > self.max_bytes and self._entries:
+                old_key, size = self._entries.popitem(last=False)
+                self._size -= size
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+
+class CodecPool:
+    """
+    Пул заранее созданных кодеков и микшеров.
+
+    Для каждого формата хранится до size пар (кодек, микшер). Пара берется
+    из пула на время конвертации и возвращается обратно, поэтому дорогая
+    настройка кодека выполняется один раз. Если все пары формата заняты,
+    acquire ждет освобождения. При warm_up=True пары создаются сразу.
+    """
+
+    def __init__(self, size=4, formats=('mp4', 'ogg'), warm_up=True):
+        self.size = size
+        self._lock = Lock()
+        self._queues: Dict[str, Queue] = {}
+        self._created: Dict[str, int] = {}
+        if warm_up:
+            for format in formats:
+                queue = self._queue(format)
+                for _ in range(size):
+                    queue.put(self._create(format))
+
+    def _queue(self, format) -> Queue:
+        with self._lock:
+            if format not in self._queues:
+                self._queues[format] = Queue(maxsize=self.size)
+                self._created[format] = 0
+            return self._queues[format]
+
+    def _create(self, format) -> Optional[Tuple[object, AudioMixer]]:
+        """
+        Создает пару для format, если их еще меньше size, иначе возвращает None.
+
+        Место в пуле резервируется под блокировкой вместе с проверкой, а сама
+        дорогая настройка кодека выполняется уже без неё; при ошибке место
+        освобождается.
+        """
+        with self._lock:
+            if self._created[format] >= self.size:
+                return None
+            self._created[format] += 1
+        try:
+            return VideoConverter._codec(format), AudioMixer()
+        except BaseException:
+            with self._lock:
+                self._created[format] -= 1
+            raise
+
+    @contextmanager
+    def acquire(self, format, timeout=None):
+        queue = self._queue(format)
+        try:
+            item = queue.get_nowait()
+        except Empty:
+            item = self._create(format)
+            if item is None:
+                item = queue.get(timeout=timeout)
+        try:
+            yield item
+        finally:
+            queue.put(item)
+
+
+class PipelineMetrics:
+    """
+    Замеры этапов конвейера конвертации.
+
+    Для каждого этапа (read, convert, fix) собирает гистограмму времени
+    выполнения, число байт на входе и выходе и, при track_allocations=True,
+    объем памяти, выделенной за этап (через tracemalloc, что само по себе
+    замедляет программу). Фасад обращается к замерам, только если объект
+    метрик передан явно, поэтому без него накладных расходов нет.
+    """
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float('inf'))
+
+    def __init__(self, track_allocations=False):
+        self.track_allocations = track_allocations
+        if track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._lock = Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def measure(self, stage: str, func: Callable, *args, bytes_in: Optional[int] = None):
+        """Выполняет func(*args) как этап stage и записывает замеры."""
+        tracking = self.track_allocations and tracemalloc.is_tracing()
+        if tracking:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        allocated = tracemalloc.get_traced_memory()[1] - base if tracking else 0
+
+        if bytes_in is None:
+            bytes_in = len(args[0])
+        self.record(stage, elapsed, bytes_in, len(result), allocated)
+        return result
+
+    def record(self, stage: str, seconds: float, bytes_in: int, bytes_out: int, allocated: int = 0):
+        with self._lock:
+            metrics = self._stages.get(stage)
+            if metrics is None:
+                metrics = self._stages[stage] = {
+                    'count': 0, 'seconds': 0.0, 'buckets': [0] * len(self.BUCKETS),
+                    'bytes_in': 0, 'bytes_out': 0, 'allocated': 0,
+                }
+            metrics['count'] += 1
+            metrics['seconds'] += seconds
+            metrics['bytes_in'] += bytes_in
+            metrics['bytes_out'] += bytes_out
+            metrics['allocated'] += allocated
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    metrics['buckets'][i] += 1
+                    break
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        """Замеры по этапам; buckets - число вызовов в каждом интервале BUCKETS."""
+        with self._lock:
+            return {
+                stage: dict(metrics, buckets=dict(zip(self.BUCKETS, metrics['buckets'])))
+                for stage, metrics in self._stages.items()
+            }
+
+    def to_prometheus(self, prefix='video_converter') -> str:
+        """Замеры в текстовом формате Prometheus."""
+        lines: List[str] = [
+            '# HELP {0}_stage_seconds Время выполнения этапа конвертации.'.format(prefix),
+            '# TYPE {0}_stage_seconds histogram'.format(prefix),
+        ]
+        stages = self.as_dict()
+        for stage, metrics in stages.items():
+            cumulative = 0
+            for bound, count in metrics['buckets'].items():
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{0}_stage_seconds_bucket{{stage="{1}",le="{2}"}} {3}'.format(prefix, stage, le, cumulative))
+            lines.append('{0}_stage_seconds_sum{{stage="{1}"}} {2!r}'.format(prefix, stage, metrics['seconds']))
+            lines.append('{0}_stage_seconds_count{{stage="{1}"}} {2}'.format(prefix, stage, metrics['count']))
+
+        for name, help_text in (('bytes_in', 'Байт на входе этапа.'), ('bytes_out', 'Байт на выходе этапа.'),
+                                ('allocated', 'Байт памяти, выделенной за этап.')):
+            lines.append('# HELP {0}_stage_{1}_total {2}'.format(prefix, name, help_text))
+            lines.append('# TYPE {0}_stage_{1}_total counter'.format(prefix, name))
+            for stage, metrics in stages.items():
+                lines.append('{0}_stage_{1}_total{{stage="{2}"}} {3}'.format(prefix, name, stage, metrics[name]))
+        return '\n'.join(lines) + '\n'
 
 
 class VideoConverter:
@@ -43,21 +388,119 @@ class VideoConverter:
     """
 
     @staticmethod
-    def convert(filename, format='mp4'):
+    def convert(filename, format='mp4', mmap=False, cache: Optional[ConversionCache] = None,
+                pool: Optional[CodecPool] = None, metrics: Optional[PipelineMetrics] = None):
         """
         Методы Фасада удобны для быстрого доступа к сложной функциональности
         подсистем. Однако клиенты получают только часть возможностей подсистемы.
+
+        При mmap=True файл не читается в память целиком, а отображается в неё
+        (см. BitrateReader.map). Если передан cache, готовый результат для
+        того же содержимого, формата и кодека берется из кэша без
+        обращения к подсистеме. Если передан pool, кодек и микшер берутся
+        из пула вместо создания новых. Если передан metrics, в него
+        записываются замеры этапов read, convert и fix.
         """
+        if cache is not None:
+            # Кэш проверяется до создания кодека и микшера: при попадании
+            # дорогая настройка кодека не нужна.
+            key = cache.key(filename, format, VideoConverter._codec_class(format))
+            result = cache.get(key)
+            if result is not None:
+                return result
+
+        if pool is None:
+            codec, mixer = VideoConverter._codec(format), AudioMixer()
+            result = VideoConverter._convert(filename, mmap, metrics, codec, mixer)
+        else:
+            with pool.acquire(format) as (codec, mixer):
+                result = VideoConverter._convert(filename, mmap, metrics, codec, mixer)
+        if cache is not None:
+            cache.put(key, result)
+        return result
+
+    @staticmethod
+    def _convert(filename, mmap, metrics, codec, mixer):
         file = VideoFile(filename)
-        if format == 'mp4':
-            codec = MPEG4CompressionCodec()
+        read = BitrateReader.map if mmap else BitrateReader.read
+        if metrics is None:
+            buffer = read(file)
+            result = BitrateReader.convert(buffer, codec)
+            result = mixer.fix(result)
         else:
-            codec = OggCompressionCodec()
-        buffer = BitrateReader.read(file)
-        result = BitrateReader.convert(buffer, codec)
-        result = AudioMixer().fix(result)
+            buffer = metrics.measure('read', read, file, bytes_in=os.path.getsize(filename))
+            result = metrics.measure('convert', BitrateReader.convert, buffer, codec)
+            result = metrics.measure('fix', mixer.fix, result)
         return result
 
+    @staticmethod
+    def _codec_class(format) -> type:
+        if format == 'mp4':
+            return MPEG4CompressionCodec
+        return OggCompressionCodec
+
+    @staticmethod
+    def _codec(format):
+        return VideoConverter._codec_class(format)()
+
+    @staticmethod
+    def convert_stream(filename, format='mp4', chunk_size=CHUNK_SIZE, mmap=False) -> Iterator[bytes]:
+        """
+        Потоковый вариант convert.
+
+        Чтение, конвертация и сведение звука соединены в конвейер генераторов
+        и обрабатывают файл частями по chunk_size байт, поэтому в памяти
+        одновременно находится лишь несколько частей, а не весь файл.
+        При mmap=True части читаются срезами отображенного в память файла.
+        """
+        file = VideoFile(filename)
+        codec = VideoConverter._codec(format)
+        chunks = BitrateReader.read_chunks(file, chunk_size, mmap)
+        chunks = BitrateReader.convert_chunks(chunks, codec)
+        return AudioMixer().fix_chunks(chunks)
+
+    @staticmethod
+    def convert_to(filename, fileobj: BinaryIO, format='mp4', chunk_size=CHUNK_SIZE, mmap=False) -> int:
+        """Конвертирует файл потоково прямо в fileobj и возвращает число записанных байт."""
+        written = 0
+        for chunk in VideoConverter.convert_stream(filename, format, chunk_size, mmap):
+            fileobj.write(chunk)
+            written += len(chunk)
+        return written
+
+    @staticmethod
+    def convert_many(
+            filenames: Iterable[str], format='mp4', workers: Optional[int] = None,
+    ) -> Iterator[ConversionResult]:
+        """
+        Конвертирует много файлов в пуле процессов.
+
+        Большие файлы отправляются в пул первыми, чтобы в конце пакета не
+        остался один долгий файл на одном ядре. Результаты возвращаются по
+        мере готовности, ошибка конвертации файла возвращается в поле error
+        его результата и не прерывает остальные.
+        """
+        def size(filename):
+            try:
+                return os.path.getsize(filename)
+            except OSError:
+                return 0
+
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = {
+                pool.submit(VideoConverter.convert, filename, format): filename
+                for filename in sorted(filenames, key=size, reverse=True)
+            }
+            for future in as_completed(futures):
+                error = future.exception()
+                result = future.result() if error is None else None
+                yield ConversionResult(futures[future], result, error)
+        finally:
+            # Если клиент прекратил перебор раньше, еще не начатые
+            # конвертации отменяются, а не выполняются впустую.
+            pool.shutdown(cancel_futures=True)
+
 
 def client_code(f: VideoConverter):
     """
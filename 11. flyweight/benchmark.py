@@ -0,0 +1,220 @@
+"""
+Замеры производительности для примера паттерна Легковес.
+
+Запуск из директории паттерна: python benchmark.py
+"""
+import io
+import os
+import random
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from multiprocessing import Manager, Pool
+from tempfile import TemporaryDirectory
+
+from example import BufferCanvas, ColumnarForest, Forest, SharedTreeTypeTable, TreeType, TreeTypeFactory
+
+
+def bench_intern(trees=10 ** 6, types=10 ** 3):
+    """Сажает trees деревьев types различных типов и проверяет число легковесов."""
+    forest = Forest()
+    start = time.perf_counter()
+    for i in range(trees):
+        t = i % types
+        forest.plant_tree(i, i, 'tree-{0}'.format(t), 'green', 'texture-{0}'.format(t))
+    elapsed = time.perf_counter() - start
+
+    assert len(TreeTypeFactory.tree_types) == types
+    print('intern: {0} деревьев, {1} типов за {2:.2f} c (hits={3}, misses={4})'.format(
+        trees, len(TreeTypeFactory.tree_types), elapsed, TreeTypeFactory.hits, TreeTypeFactory.misses,
+    ))
+
+
+def bench_memory(trees=10 ** 6, types=10 ** 3):
+    """Сравнивает расход памяти на дерево у Forest и ColumnarForest."""
+    for t in range(types):
+        TreeTypeFactory.get_tree_type('tree-{0}'.format(t), 'green', 'texture-{0}'.format(t))
+
+    for forest_class in (Forest, ColumnarForest):
+        tracemalloc.start()
+        forest = forest_class()
+        for i in range(trees):
+            t = i % types
+            forest.plant_tree(i, i, 'tree-{0}'.format(t), 'green', 'texture-{0}'.format(t))
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('memory: {0} - {1:.1f} байт на дерево'.format(forest_class.__name__, size / trees))
+        del forest
+
+
+def bench_viewport(trees=10 ** 7, types=10 ** 3, world=10 ** 4):
+    """Сравнивает отрисовку 1% площади через индекс и полным проходом по лесу."""
+    for t in range(types):
+        TreeTypeFactory.get_tree_type('tree-{0}'.format(t), 'green', 'texture-{0}'.format(t))
+
+    forest = ColumnarForest()
+    rnd = random.Random(0)
+    chunk = 10 ** 6
+    for _ in range(trees // chunk):
+        forest.plant_many(
+            [rnd.randrange(world) for _ in range(chunk)],
+            [rnd.randrange(world) for _ in range(chunk)],
+            [rnd.randrange(types) for _ in range(chunk)],
+        )
+
+    side = world // 10
+    viewport = (0, 0, side - 1, side - 1)
+    with redirect_stdout(io.StringIO()) as out:
+        start = time.perf_counter()
+        forest.draw(viewport=viewport)
+        indexed = time.perf_counter() - start
+    visible = out.getvalue().count('\n')
+
+    start = time.perf_counter()
+    x0, y0, x1, y1 = viewport
+    scanned = sum(1 for x, y in zip(forest._xs, forest._ys) if x0 <= x <= x1 and y0 <= y <= y1)
+    linear = time.perf_counter() - start
+
+    assert scanned == visible
+    print('viewport: {0} деревьев, видно {1}: индекс {2:.3f} c, полный проход (без отрисовки) {3:.3f} c'.format(
+        trees, visible, indexed, linear,
+    ))
+
+
+def bench_batch_draw(trees=10 ** 6, types=10 ** 3, size=1000):
+    """Сравнивает число отрисованных деревьев в секунду: по одному и пачками."""
+    for t in range(types):
+        TreeTypeFactory.get_tree_type('tree-{0}'.format(t), (t % 256, 128, 0, 255), 'texture-{0}'.format(t))
+
+    forest = ColumnarForest()
+    rnd = random.Random(0)
+    forest.plant_many(
+        [rnd.randrange(size) for _ in range(trees)],
+        [rnd.randrange(size) for _ in range(trees)],
+        [rnd.randrange(types) for _ in range(trees)],
+    )
+
+    for method in (forest.draw, forest.draw_batch):
+        canvas = BufferCanvas(size, size)
+        start = time.perf_counter()
+        method(canvas=canvas)
+        elapsed = time.perf_counter() - start
+        print('draw: {0} - {1:.0f} деревьев/с'.format(method.__name__, trees / elapsed))
+
+
+def memory_usage():
+    """
+    RSS и PSS процесса в байтах из /proc/self/smaps_rollup (только Linux).
+
+    В отличие от tracemalloc учитывают и страницы разделяемой памяти: PSS
+    делит каждую общую страницу поровну между процессами, которые её
+    отобразили.
+    """
+    usage = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                usage[key] = int(value.split()[0]) * 1024
+    return usage['Rss'], usage['Pss']
+
+
+def _touch(texture, page_size=4096):
+    """Читает по байту с каждой страницы текстуры, чтобы страницы попали в память процесса."""
+    return sum(texture[::page_size])
+
+
+def _rebuild_table(types, texture_size, barrier):
+    rss, pss = memory_usage()
+    table = [TreeType('tree-{0}'.format(t), 'green', bytes([t % 256]) * texture_size) for t in range(types)]
+    checksum = sum(_touch(tree_type.texture) for tree_type in table)
+    # Замер после того, как все процессы заполнили таблицы.
+    barrier.wait()
+    rss_after, pss_after = memory_usage()
+    barrier.wait()
+    return rss_after - rss, pss_after - pss, checksum
+
+
+def _attach_table(name, barrier):
+    rss, pss = memory_usage()
+    table = SharedTreeTypeTable.attach(name)
+    checksum = sum(_touch(table[t].texture) for t in range(len(table)))
+    # PSS общих страниц делится между процессами, поэтому замер - когда
+    # таблицу отобразили все процессы.
+    barrier.wait()
+    rss_after, pss_after = memory_usage()
+    barrier.wait()
+    table.release()
+    table.close()
+    return rss_after - rss, pss_after - pss, checksum
+
+
+def bench_shared_table(workers=8, types=10 ** 3, texture_size=64 * 1024):
+    """Сравнивает прирост RSS и PSS рабочих процессов: своя копия таблицы против разделяемой."""
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print('shared: нужен /proc/self/smaps_rollup (Linux), замер пропущен')
+        return
+
+    tree_types = [TreeType('tree-{0}'.format(t), 'green', bytes([t % 256]) * texture_size) for t in range(types)]
+    shared = SharedTreeTypeTable.publish(tree_types)
+    del tree_types
+    try:
+        with Manager() as manager:
+            barrier = manager.Barrier(workers)
+            with Pool(workers) as pool:
+                rebuilt = pool.starmap(_rebuild_table, [(types, texture_size, barrier)] * workers)
+            with Pool(workers) as pool:
+                attached = pool.starmap(_attach_table, [(shared.name, barrier)] * workers)
+    finally:
+        shared.close()
+        shared.unlink()
+
+    assert {checksum for _, _, checksum in rebuilt} == {checksum for _, _, checksum in attached}
+    for title, results in (('копия', rebuilt), ('shared_memory', attached)):
+        rss = max(rss for rss, _, _ in results)
+        pss = max(pss for _, pss, _ in results)
+        print('shared: {0} процессов, {1} - прирост RSS {2:.1f} МБ, PSS {3:.1f} МБ на процесс, '
+              'PSS всего {4:.1f} МБ'.format(workers, title, rss / 2 ** 20, pss / 2 ** 20, pss * workers / 2 ** 20))
+
+
+def bench_snapshot(trees=10 ** 7, types=10 ** 3, world=10 ** 4):
+    """Сохраняет лес в снимок и сравнивает загрузку с разбором и через mmap."""
+    for t in range(types):
+        TreeTypeFactory.get_tree_type('tree-{0}'.format(t), 'green', 'texture-{0}'.format(t))
+
+    forest = ColumnarForest()
+    rnd = random.Random(0)
+    chunk = 10 ** 6
+    for _ in range(trees // chunk):
+        forest.plant_many(
+            [rnd.randrange(world) for _ in range(chunk)],
+            [rnd.randrange(world) for _ in range(chunk)],
+            [rnd.randrange(types) for _ in range(chunk)],
+        )
+
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'forest.bin')
+        start = time.perf_counter()
+        forest.save(path)
+        print('snapshot: сохранение {0} деревьев ({1:.0f} МБ) за {2:.3f} c'.format(
+            trees, os.path.getsize(path) / 2 ** 20, time.perf_counter() - start,
+        ))
+
+        for use_mmap in (False, True):
+            start = time.perf_counter()
+            loaded = ColumnarForest.load(path, mmap=use_mmap)
+            elapsed = time.perf_counter() - start
+            assert len(loaded) == trees
+            assert loaded._xs[trees // 2] == forest._xs[trees // 2]
+            assert loaded._type_ids[-1] == forest._type_ids[-1]
+            print('snapshot: загрузка mmap={0} за {1:.4f} c'.format(use_mmap, elapsed))
+            del loaded
+
+
+if __name__ == '__main__':
+    bench_intern()
+    bench_memory()
+    bench_viewport()
+    bench_batch_draw()
+    bench_shared_table()
+    bench_snapshot()
@@ -1,4 +1,63 @@
-from typing import List
+import mmap as mmap_module
+import struct
+import sys
+from abc import ABC, abstractmethod
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+Viewport = Tuple[int, int, int, int]
+
+
+class Canvas(ABC):
+    """
+    Интерфейс холста.
+
+    Холст получает от Легковеса сразу все координаты деревьев одного типа,
+    поэтому накладные расходы на вызов приходятся на тип, а не на дерево.
+    """
+
+    @abstractmethod
+    def draw_trees(self, tree_type: 'TreeType', xs: Iterable[int], ys: Iterable[int]):
+        pass
+
+
+class PrintCanvas(Canvas):
+    """Холст, который печатает каждое дерево в стандартный вывод."""
+
+    def draw_trees(self, tree_type, xs, ys):
+        for x, y in zip(xs, ys):
+            print('Отрисовка дерева с координатами ({x},{y}) типа {name}'.format(x=x, y=y, name=tree_type.name))
+
+
+class BufferCanvas(Canvas):
+    """
+    Холст в оперативной памяти.
+
+    Хранит изображение в буфере RGBA размером width * height * 4 байт. Цвет
+    легковеса берется из palette по имени, либо задается кортежем (r, g, b, a).
+    Деревья за пределами холста пропускаются.
+    """
+
+    def __init__(self, width: int, height: int, palette: Optional[Dict[str, Tuple[int, int, int, int]]] = None):
+        self.width = width
+        self.height = height
+        self.buffer = bytearray(width * height * 4)
+        self._palette = palette or {}
+
+    def _rgba(self, color) -> bytes:
+        if isinstance(color, tuple):
+            return bytes(color)
+        return bytes(self._palette.get(color, (255, 255, 255, 255)))
+
+    def draw_trees(self, tree_type, xs, ys):
+        rgba = self._rgba(tree_type.color)
+        buffer, width, height = self.buffer, self.width, self.height
+        for x, y in zip(xs, ys):
+            if 0 <= x < width and 0 <= y < height:
+                offset = (y * width + x) * 4
+                buffer[offset:offset + 4] = rgba
 
 
 class TreeType:
@@ -10,11 +69,16 @@ class TreeType:
     уникальное для каждого объекта) через его параметры метода.
     """
 
-    def __init__(self, name, color, texture):
+    def __init__(self, name, color, texture, type_id=None):
+        self._id = type_id
         self._name = name
         self._color = color
         self._texture = texture
 
+    @property
+    def id(self):
+        return self._id
+
     @property
     def name(self):
         return self._name
@@ -25,10 +89,14 @@ class TreeType:
 
     @property
     def texture(self):
-        return self.texture()
+        return self._texture
+
+    def draw(self, x, y, canvas: Optional[Canvas] = None):
+        self.draw_batch((x,), (y,), canvas)
 
-    def draw(self, x, y, canvas=None):
-        print('Отрисовка дерева с координатами ({x},{y}) типа {name}'.format(x=x, y=y, name=self.name))
+    def draw_batch(self, xs: Iterable[int], ys: Iterable[int], canvas: Optional[Canvas] = None):
+        """Отрисовывает все деревья данного типа за один вызов."""
+        (canvas or PrintCanvas()).draw_trees(self, xs, ys)
 
 
 class TreeTypeFactory:
@@ -40,23 +108,159 @@ class TreeTypeFactory:
     легковес, фабрика либо возвращает существующий экземпляр, либо создает
     новый, если он ещё не существует.
     """
-    tree_types: List[TreeType] = []
+    tree_types: Dict[Tuple, TreeType] = {}
+    tree_types_by_id: List[TreeType] = []
+    hits = 0
+    misses = 0
+    _lock = Lock()
 
     @classmethod
     def get_tree_type(cls, name, color, texture):
         """
         Возвращает существующий Легковес с заданным состоянием или создает
         новый.
-        """
-        for tree_type in cls.tree_types:
-            if (tree_type.name == name and tree_type.color == color
-                    and tree_type.texture == texture):
-                return tree_type
 
-            tree_type = TreeType(name, color, texture)
-            cls.tree_types.append(tree_type)
+        Легковесы хранятся в словаре по ключу (name, color, texture), поэтому
+        поиск выполняется за O(1). Поиск, вставка и обновление счетчиков
+        hits/misses идут под одной блокировкой, чтобы два потока не создали два
+        разных объекта для одного и того же состояния и не теряли отсчеты.
+        """
+        key = (name, color, texture)
+        with cls._lock:
+            tree_type = cls.tree_types.get(key)
+            if tree_type is None:
+                cls.misses += 1
+                tree_type = TreeType(name, color, texture, type_id=len(cls.tree_types_by_id))
+                cls.tree_types_by_id.append(tree_type)
+                cls.tree_types[key] = tree_type
+            else:
+                cls.hits += 1
             return tree_type
 
+    @classmethod
+    def get_tree_type_by_id(cls, type_id: int) -> TreeType:
+        """Возвращает Легковес по его порядковому номеру в фабрике."""
+        return cls.tree_types_by_id[type_id]
+
+
+class TreeTypeTable:
+    """
+    Таблица легковесов только для чтения поверх непрерывного буфера.
+
+    Внутреннее состояние всех легковесов упаковано в один буфер: заголовок,
+    таблица смещений полей и сами данные. Поле может быть строкой, байтами
+    или кортежем целых чисел (например, цвет RGBA); тип поля хранится
+    вместе с ним. Таблица не копирует данные при чтении: текстура типа
+    bytes возвращается как memoryview на участок буфера. Упакованную
+    таблицу можно разместить в разделяемой памяти или в файле.
+    """
+    MAGIC = b'TREE'
+    VERSION = 2
+    # Версия 1 отличается только отсутствием кортежей.
+    SUPPORTED_VERSIONS = (1, 2)
+    HEADER = struct.Struct('<4sHI')
+    FIELD = struct.Struct('<BII')
+
+    _STR, _BYTES, _TUPLE = 0, 1, 2
+
+    @classmethod
+    def pack(cls, tree_types: List[TreeType]) -> bytes:
+        """Упаковывает легковесы в буфер. Номер легковеса - его позиция в списке."""
+        fields = []
+        payload = bytearray()
+        data_offset = cls.HEADER.size + cls.FIELD.size * 3 * len(tree_types)
+        for tree_type in tree_types:
+            for value in (tree_type.name, tree_type.color, tree_type.texture):
+                kind, value = cls._encode_field(value)
+                fields.append(cls.FIELD.pack(kind, data_offset + len(payload), len(value)))
+                payload += value
+
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(tree_types))
+        return header + b''.join(fields) + payload
+
+    @classmethod
+    def _encode_field(cls, value) -> Tuple[int, bytes]:
+        if isinstance(value, str):
+            return cls._STR, value.encode('utf-8')
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return cls._BYTES, bytes(value)
+        if isinstance(value, tuple) and all(type(item) is int for item in value):
+            return cls._TUPLE, struct.pack('<{0}q'.format(len(value)), *value)
+        raise TypeError('Поле легковеса типа {0} нельзя упаковать в таблицу: поддерживаются str, '
+                        'bytes и кортежи int'.format(type(value).__name__))
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer).toreadonly()
+        magic, version, count = self.HEADER.unpack_from(self._buffer)
+        if magic != self.MAGIC or version not in self.SUPPORTED_VERSIONS:
+            raise ValueError('Неизвестный формат таблицы легковесов')
+        self._count = count
+        self._views: Dict[int, TreeType] = {}
+
+    def __len__(self):
+        return self._count
+
+    def _field(self, type_id: int, number: int):
+        offset = self.HEADER.size + self.FIELD.size * (type_id * 3 + number)
+        kind, start, length = self.FIELD.unpack_from(self._buffer, offset)
+        value = self._buffer[start:start + length]
+        if kind == self._STR:
+            return str(value, 'utf-8')
+        if kind == self._TUPLE:
+            return struct.unpack('<{0}q'.format(length // 8), value)
+        return value
+
+    def __getitem__(self, type_id: int) -> TreeType:
+        view = self._views.get(type_id)
+        if view is None:
+            if not 0 <= type_id < self._count:
+                raise IndexError(type_id)
+            view = TreeType(self._field(type_id, 0), self._field(type_id, 1), self._field(type_id, 2), type_id=type_id)
+            self._views[type_id] = view
+        return view
+
+    def release(self):
+        """Освобождает буфер. Полученные ранее текстуры к этому моменту должны быть удалены."""
+        self._views.clear()
+        self._buffer.release()
+
+
+class SharedTreeTypeTable(TreeTypeTable):
+    """
+    Таблица легковесов в разделяемой памяти.
+
+    Главный процесс один раз публикует внутреннее состояние легковесов, а
+    рабочие процессы подключаются к нему по имени сегмента без копирования,
+    поэтому память каждого процесса не растет с числом процессов.
+    """
+
+    def __init__(self, shm: SharedMemory):
+        super().__init__(shm.buf)
+        self._shm = shm
+
+    @classmethod
+    def publish(cls, tree_types: List[TreeType], name: Optional[str] = None) -> 'SharedTreeTypeTable':
+        data = cls.pack(tree_types)
+        shm = SharedMemory(name=name, create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedTreeTypeTable':
+        return cls(SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def close(self):
+        self.release()
+        self._shm.close()
+
+    def unlink(self):
+        """Удаляет сегмент. Вызывается один раз процессом, который его опубликовал."""
+        self._shm.unlink()
+
 
 class Tree:
     """
@@ -75,6 +279,43 @@ class Tree:
         self.tree_type.draw(self.x, self.y, canvas=canvas)
 
 
+class GridIndex:
+    """
+    Пространственный индекс леса (равномерная сетка).
+
+    Плоскость разбита на квадратные ячейки со стороной cell_size. Для каждой
+    ячейки хранится массив номеров деревьев, попавших в неё. Запрос по
+    прямоугольнику обходит только пересекающиеся с ним ячейки, поэтому время
+    отрисовки зависит от числа видимых деревьев, а не от размера леса.
+    """
+
+    def __init__(self, cell_size: int = 64):
+        self._cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], array] = {}
+
+    def insert(self, x: int, y: int, index: int):
+        key = (x // self._cell_size, y // self._cell_size)
+        cell = self._cells.get(key)
+        if cell is None:
+            cell = self._cells[key] = array('L')
+        cell.append(index)
+
+    def query(self, viewport: Viewport) -> Iterator[int]:
+        """
+        Возвращает номера деревьев из ячеек, пересекающих прямоугольник.
+
+        Деревья из пограничных ячеек могут лежать за его пределами, поэтому
+        вызывающий код должен дополнительно проверить координаты.
+        """
+        x0, y0, x1, y1 = viewport
+        size = self._cell_size
+        for cx in range(x0 // size, x1 // size + 1):
+            for cy in range(y0 // size, y1 // size + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is not None:
+                    yield from cell
+
+
 class Forest:
     """
     Класс леса.
@@ -83,14 +324,235 @@ class Forest:
     объекта Контекста.
     """
 
-    def __init__(self):
+    def __init__(self, cell_size: int = 64):
         self._trees = []
+        self._index = GridIndex(cell_size)
 
     def plant_tree(self, x, y, name, color, texture):
         tree_type = TreeTypeFactory.get_tree_type(name, color, texture)
         tree = Tree(x, y, tree_type)
+        self._index.insert(x, y, len(self._trees))
         self._trees.append(tree)
 
-    def draw(self):
-        for tree in self._trees:
-            tree.draw()
+    def _visible_trees(self, viewport: Optional[Viewport]) -> Iterator[Tree]:
+        if viewport is None:
+            yield from self._trees
+            return
+
+        x0, y0, x1, y1 = viewport
+        for index in self._index.query(viewport):
+            tree = self._trees[index]
+            if x0 <= tree.x <= x1 and y0 <= tree.y <= y1:
+                yield tree
+
+    def draw(self, viewport: Optional[Viewport] = None, canvas: Optional[Canvas] = None):
+        """Отрисовывает все деревья или только попавшие в прямоугольник (x0, y0, x1, y1)."""
+        for tree in self._visible_trees(viewport):
+            tree.draw(canvas=canvas)
+
+    def draw_batch(self, viewport: Optional[Viewport] = None, canvas: Optional[Canvas] = None):
+        """
+        Группирует деревья по Легковесу и передает каждому из них сплошные
+        массивы координат, чтобы отрисовать все деревья типа за один вызов.
+        """
+        batches: Dict[TreeType, Tuple[array, array]] = {}
+        for tree in self._visible_trees(viewport):
+            batch = batches.get(tree.tree_type)
+            if batch is None:
+                batch = batches[tree.tree_type] = (array('q'), array('q'))
+            batch[0].append(tree.x)
+            batch[1].append(tree.y)
+
+        for tree_type, (xs, ys) in batches.items():
+            tree_type.draw_batch(xs, ys, canvas)
+
+
+class ColumnarForest:
+    """
+    Класс леса с поколоночным хранением.
+
+    Вместо объекта Контекста на каждое дерево внешнее состояние хранится в
+    типизированных массивах: координаты x, y и номер легковеса в фабрике.
+    Сам Легковес по номеру возвращает `TreeTypeFactory`. Так на одно дерево
+    приходится несколько байт вместо отдельного Python-объекта.
+
+    Лес можно сохранить в бинарный снимок и загрузить обратно. Снимок состоит
+    из заголовка, упакованной таблицы легковесов (`TreeTypeTable`) и трех
+    колонок: x, y (int64) и номера легковесов (uint16), все little-endian.
+    При загрузке через mmap колонки не разбираются, а отображаются в память
+    как есть, поэтому загрузка занимает время, не зависящее от размера леса.
+
+    Номер легковеса хранится в uint16, поэтому лес вмещает не больше
+    MAX_TREE_TYPES разных легковесов.
+    """
+    MAX_TREE_TYPES = 2 ** 16
+    SNAPSHOT_MAGIC = b'FRST'
+    SNAPSHOT_VERSION = 1
+    SNAPSHOT_HEADER = struct.Struct('<4sHIQ')
+
+    def __init__(self, cell_size: int = 64):
+        self._xs = array('q')
+        self._ys = array('q')
+        self._type_ids = array('H')
+        self._cell_size = cell_size
+        self._index: Optional[GridIndex] = GridIndex(cell_size)
+        self._mmap = None
+
+    def __len__(self):
+        return len(self._type_ids)
+
+    def _make_writable(self):
+        """Копирует отображенные из снимка колонки в массивы перед изменением."""
+        if self._mmap is not None:
+            self._xs, self._ys, self._type_ids = array('q', self._xs), array('q', self._ys), array('H', self._type_ids)
+            self._mmap = None
+
+    def _get_index(self) -> GridIndex:
+        """Индекс строится при первом запросе, если лес был загружен из снимка."""
+        if self._index is None:
+            index = GridIndex(self._cell_size)
+            for i, (x, y) in enumerate(zip(self._xs, self._ys)):
+                index.insert(x, y, i)
+            self._index = index
+        return self._index
+
+    @classmethod
+    def _check_type_id(cls, type_id: int):
+        if not 0 <= type_id < cls.MAX_TREE_TYPES:
+            raise ValueError('Номер легковеса {0} не помещается в колонку uint16: лес вмещает не больше {1} '
+                             'легковесов'.format(type_id, cls.MAX_TREE_TYPES))
+        if type_id >= len(TreeTypeFactory.tree_types_by_id):
+            raise ValueError('Легковеса с номером {0} нет в TreeTypeFactory'.format(type_id))
+
+    def plant_tree(self, x, y, name, color, texture):
+        tree_type = TreeTypeFactory.get_tree_type(name, color, texture)
+        self._check_type_id(tree_type.id)
+        self._make_writable()
+        if self._index is not None:
+            self._index.insert(x, y, len(self._type_ids))
+        self._xs.append(x)
+        self._ys.append(y)
+        self._type_ids.append(tree_type.id)
+
+    def plant_many(self, xs: Iterable[int], ys: Iterable[int], type_ids: Iterable[int]):
+        """Сажает сразу много деревьев уже известных типов."""
+        xs, ys, type_ids = array('q', xs), array('q', ys), array('q', type_ids)
+        if type_ids:
+            self._check_type_id(min(type_ids))
+            self._check_type_id(max(type_ids))
+        type_ids = array('H', type_ids)
+        if not len(xs) == len(ys) == len(type_ids):
+            raise ValueError('Длины xs, ys и type_ids должны совпадать')
+
+        self._make_writable()
+        if self._index is not None:
+            insert = self._index.insert
+            for index, (x, y) in enumerate(zip(xs, ys), start=len(self._type_ids)):
+                insert(x, y, index)
+        self._xs.extend(xs)
+        self._ys.extend(ys)
+        self._type_ids.extend(type_ids)
+
+    def save(self, path: str):
+        """Сохраняет лес в бинарный снимок."""
+        tree_types = TreeTypeFactory.tree_types_by_id
+        table = TreeTypeTable.pack(tree_types)
+        header = self.SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, len(table), len(self))
+        padding = -(len(header) + len(table)) % 8
+
+        columns = [array('q', self._xs), array('q', self._ys), array('H', self._type_ids)]
+        if sys.byteorder != 'little':
+            for column in columns:
+                column.byteswap()
+
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(table)
+            f.write(bytes(padding))
+            for column in columns:
+                f.write(column)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, cell_size: int = 64) -> 'ColumnarForest':
+        """
+        Загружает лес из снимка.
+
+        Легковесы из снимка регистрируются в `TreeTypeFactory`. Если их номера
+        в фабрике совпадают с сохраненными, колонки при mmap=True используются
+        прямо из отображенного файла, иначе копируется только колонка номеров.
+        """
+        with open(path, 'rb') as f:
+            if mmap and sys.byteorder == 'little':
+                data = memoryview(mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ))
+            else:
+                data = memoryview(f.read())
+
+        magic, version, table_size, count = cls.SNAPSHOT_HEADER.unpack_from(data)
+        if magic != cls.SNAPSHOT_MAGIC or version != cls.SNAPSHOT_VERSION:
+            raise ValueError('Неизвестный формат снимка леса')
+
+        offset = cls.SNAPSHOT_HEADER.size
+        table = TreeTypeTable(data[offset:offset + table_size])
+        type_id_map = []
+        for i in range(len(table)):
+            # Поля-байты копируются из буфера снимка: иначе фабрика держала бы
+            # его срезы и регистрировала memoryview как отдельные легковесы.
+            name, color, texture = (
+                bytes(value) if isinstance(value, memoryview) else value
+                for value in (table[i].name, table[i].color, table[i].texture)
+            )
+            type_id_map.append(TreeTypeFactory.get_tree_type(name, color, texture).id)
+        table.release()
+
+        offset += table_size + -(offset + table_size) % 8
+        columns = []
+        for typecode, itemsize in (('q', 8), ('q', 8), ('H', 2)):
+            columns.append(data[offset:offset + count * itemsize].cast(typecode))
+            offset += count * itemsize
+
+        forest = cls(cell_size)
+        forest._index = None
+        if isinstance(data.obj, mmap_module.mmap):
+            forest._mmap = data.obj
+        else:
+            columns = [array(column.format, column) for column in columns]
+            if sys.byteorder != 'little':
+                for column in columns:
+                    column.byteswap()
+        forest._xs, forest._ys, forest._type_ids = columns
+
+        if type_id_map != list(range(len(type_id_map))):
+            forest._type_ids = array('H', (type_id_map[type_id] for type_id in forest._type_ids))
+        return forest
+
+    def _visible_rows(self, viewport: Optional[Viewport]) -> Iterator[Tuple[int, int, int]]:
+        if viewport is None:
+            yield from zip(self._xs, self._ys, self._type_ids)
+            return
+
+        x0, y0, x1, y1 = viewport
+        xs, ys, type_ids = self._xs, self._ys, self._type_ids
+        for index in self._get_index().query(viewport):
+            x, y = xs[index], ys[index]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                yield x, y, type_ids[index]
+
+    def draw(self, viewport: Optional[Viewport] = None, canvas: Optional[Canvas] = None):
+        """Отрисовывает все деревья или только попавшие в прямоугольник (x0, y0, x1, y1)."""
+        get_tree_type = TreeTypeFactory.get_tree_type_by_id
+        for x, y, type_id in self._visible_rows(viewport):
+            get_tree_type(type_id).draw(x, y, canvas)
+
+    def draw_batch(self, viewport: Optional[Viewport] = None, canvas: Optional[Canvas] = None):
+        """Отрисовывает деревья пачками, по одному вызову на каждый Легковес."""
+        batches: Dict[int, Tuple[array, array]] = {}
+        for x, y, type_id in self._visible_rows(viewport):
+            batch = batches.get(type_id)
+            if batch is None:
+                batch = batches[type_id] = (array('q'), array('q'))
+            batch[0].append(x)
+            batch[1].append(y)
+
+        get_tree_type = TreeTypeFactory.get_tree_type_by_id
+        for type_id, (xs, ys) in batches.items():
+            get_tree_type(type_id).draw_batch(xs, ys, canvas)
@@ -0,0 +1,97 @@
+"""
+Замеры производительности для примера паттерна Заместитель.
+
+Запуск из директории паттерна: python benchmark.py
+"""
+import random
+import threading
+import time
+
+from example import CachingProxy, LazyProxy, ServiceInterface
+
+
+class SlowService(ServiceInterface):
+    """Намеренно медленный сервис: каждый вызов занимает delay секунд."""
+
+    def __init__(self, delay=0.005):
+        self.delay = delay
+
+    def operation(self, *args, **kwargs):
+        time.sleep(self.delay)
+        return args
+
+
+def bench_caching_proxy(calls=500):
+    """Средняя задержка вызова через CachingProxy при разной доле попаданий в кэш."""
+    rnd = random.Random(0)
+    for hit_rate in (0.0, 0.5, 0.9, 0.99):
+        proxy = CachingProxy(SlowService(), max_size=1000)
+        proxy.operation('hot')
+        start = time.perf_counter()
+        for i in range(calls):
+            proxy.operation('hot' if rnd.random() < hit_rate else 'cold-{0}'.format(i))
+        elapsed = time.perf_counter() - start
+        stats = proxy.stats
+        print('caching: попаданий {0:.0%} - {1:.3f} мс на вызов'.format(
+            stats.hits / calls, elapsed / calls * 1000,
+        ))
+
+
+class HeavyService(ServiceInterface):
+    """Сервис с дорогой инициализацией (подключения, загрузка данных и т.п.)."""
+
+    created = 0
+
+    def __init__(self, init_delay=0.002):
+        time.sleep(init_delay)
+        HeavyService.created += 1
+
+    def operation(self, *args, **kwargs):
+        return args
+
+
+def bench_lazy_startup(services=100, used=5):
+    """Время старта приложения, связывающего services сервисов, из которых используются used."""
+    start = time.perf_counter()
+    eager = [HeavyService() for _ in range(services)]
+    eager_startup = time.perf_counter() - start
+    for service in eager[:used]:
+        service.operation()
+
+    start = time.perf_counter()
+    lazy = [LazyProxy(HeavyService) for _ in range(services)]
+    lazy_startup = time.perf_counter() - start
+    start = time.perf_counter()
+    for proxy in lazy[:used]:
+        proxy.operation()
+    lazy_first_calls = time.perf_counter() - start
+
+    print('lazy: старт с {0} сервисами - сразу {1:.1f} мс, лениво {2:.3f} мс '
+          '(+{3:.1f} мс на первые вызовы {4} сервисов)'.format(
+              services, eager_startup * 1000, lazy_startup * 1000, lazy_first_calls * 1000, used,
+          ))
+
+
+def bench_lazy_contention(threads=8):
+    """Первый вызов одновременно из нескольких потоков создает сервис ровно один раз."""
+    HeavyService.created = 0
+    proxy = LazyProxy(lambda: HeavyService(init_delay=0.05))
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        barrier.wait()
+        proxy.operation()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    assert HeavyService.created == 1
+    print('lazy: {0} потоков, создано сервисов - {1}'.format(threads, HeavyService.created))
+
+
+if __name__ == '__main__':
+    bench_caching_proxy()
+    bench_lazy_startup()
+    bench_lazy_contention()
@@ -1,4 +1,10 @@
+import asyncio
+import inspect
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from typing import Awaitable, Callable, Optional, Union
 
 
 class ServiceInterface(ABC):
@@ -9,7 +15,7 @@ class ServiceInterface(ABC):
     """
 
     @abstractmethod
-    def operation(self):
+    def operation(self, *args, **kwargs):
         pass
 
 
@@ -21,7 +27,7 @@ class Service(ServiceInterface):
     без каких-либо изменений в коде Реального Сервиса.
     """
 
-    def operation(self):
+    def operation(self, *args, **kwargs):
         print('Выполение операции конкретного сервиса')
 
 
@@ -36,7 +42,7 @@ class Proxy(ServiceInterface):
     def check_access(self):
         return True
 
-    def operation(self):
+    def operation(self, *args, **kwargs):
         """
         Наиболее распространёнными областями применения паттерна Заместитель
         являются ленивая загрузка, кэширование, контроль доступа, ведение
@@ -46,7 +52,133 @@ class Proxy(ServiceInterface):
         """
         print('Выполнение операции конкретного сервиса из объекта-фальшивки')
         if self.check_access():
-            self._real_service.operation()
+            return self._real_service.operation(*args, **kwargs)
+
+
+CacheStats = namedtuple('CacheStats', 'hits misses evictions expirations size')
+
+
+class CachingProxy(ServiceInterface):
+    """
+    Кэширующий Заместитель.
+
+    Запоминает результаты operation по аргументам вызова. Кэш ограничен
+    max_size записями: при переполнении вытесняется давно не
+    использованная. Каждая запись живет ttl секунд с момента сохранения
+    (None - без ограничения). Аргументы вызова должны быть хэшируемыми.
+    """
+
+    def __init__(self, s: ServiceInterface, max_size: int = 128, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self._real_service = s
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._cache: OrderedDict = OrderedDict()
+        self._hits = self._misses = self._evictions = self._expirations = 0
+        # Растет при каждой инвалидации: результат вызова, начатого до неё,
+        # в кэш уже не сохраняется.
+        self._generation = 0
+
+    @staticmethod
+    def _key(args, kwargs):
+        return args, frozenset(kwargs.items())
+
+    def operation(self, *args, **kwargs):
+        key = self._key(args, kwargs)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    return result
+                del self._cache[key]
+                self._expirations += 1
+            self._misses += 1
+            generation = self._generation
+
+        # Сервис вызывается без блокировки, чтобы медленный запрос
+        # не задерживал попадания в кэш по другим ключам.
+        result = self._real_service.operation(*args, **kwargs)
+        expires_at = self._clock() + self._ttl if self._ttl is not None else None
+        with self._lock:
+            if generation != self._generation:
+                return result
+            self._cache[key] = (expires_at, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+                self._evictions += 1
+        return result
+
+    def invalidate(self, *args, **kwargs):
+        """Удаляет из кэша результат вызова с данными аргументами."""
+        with self._lock:
+            self._cache.pop(self._key(args, kwargs), None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._generation += 1
+
+    @property
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._expirations, len(self._cache))
+
+
+class LazyProxy(ServiceInterface):
+    """
+    Виртуальный Заместитель.
+
+    Реальный сервис создается фабрикой только при первом вызове operation.
+    Фабрика вызывается ровно один раз, даже если первые вызовы приходят
+    одновременно из нескольких потоков. Фабрика может быть корутинной
+    функцией - тогда сервис создается через operation_async (однократность
+    гарантируется в пределах одного цикла событий).
+    """
+
+    def __init__(self, factory: Callable[[], Union[ServiceInterface, Awaitable[ServiceInterface]]]):
+        self._factory = factory
+        self._real_service: Optional[ServiceInterface] = None
+        self._lock = Lock()
+        self._async_lock = asyncio.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._real_service is not None
+
+    def _get_service(self) -> ServiceInterface:
+        # Двойная проверка: после инициализации блокировка не берется.
+        if self._real_service is None:
+            if inspect.iscoroutinefunction(self._factory):
+                raise TypeError('Асинхронная фабрика: используйте operation_async')
+            with self._lock:
+                if self._real_service is None:
+                    self._real_service = self._factory()
+        return self._real_service
+
+    async def _get_service_async(self) -> ServiceInterface:
+        if self._real_service is None:
+            if not inspect.iscoroutinefunction(self._factory):
+                # Синхронная фабрика выполняется в потоке, чтобы не блокировать
+                # цикл событий; однократность обеспечивает _get_service.
+                return await asyncio.to_thread(self._get_service)
+            async with self._async_lock:
+                if self._real_service is None:
+                    self._real_service = await self._factory()
+        return self._real_service
+
+    def operation(self, *args, **kwargs):
+        return self._get_service().operation(*args, **kwargs)
+
+    async def operation_async(self, *args, **kwargs):
+        service = await self._get_service_async()
+        return service.operation(*args, **kwargs)
 
 
 def client_code(service: ServiceInterface):
@@ -67,3 +199,16 @@ if __name__ == '__main__':
     client_code(service)
     print('-' * 75)
     client_code(Proxy(service))
+    print('-' * 75)
+
+    # Повторный вызов возьмет результат из кэша без обращения к сервису
+    caching_proxy = CachingProxy(service)
+    client_code(caching_proxy)
+    client_code(caching_proxy)
+    print('-' * 75)
+
+    # Сервис будет создан только при первом обращении к заместителю
+    lazy_proxy = LazyProxy(Service)
+    print('Сервис создан:', lazy_proxy.initialized)
+    client_code(lazy_proxy)
+    print('Сервис создан:', lazy_proxy.initialized)
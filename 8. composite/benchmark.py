@@ -0,0 +1,286 @@
+"""
+Замеры производительности для примера паттерна Компоновщик.
+
+Запуск из директории паттерна: python benchmark.py
+"""
+import json
+import math
+import os
+import pickle
+import random
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from io import BytesIO
+from copy import deepcopy
+
+from example import (
+    BoxContainer, FlatOrder, Headphones, OrderComponent, Phone, SubtreePool, diff, dump, fold, iter_breadth_first,
+    iter_preorder, load, loads,
+)
+
+
+def build_tree(fanout=10, depth=6):
+    """Строит сбалансированное дерево заказа, возвращает корень и коробки нижнего уровня."""
+    root = BoxContainer()
+    level = [root]
+    for _ in range(depth - 1):
+        next_level = []
+        for box in level:
+            for _ in range(fanout):
+                child = BoxContainer()
+                box.add(child)
+                next_level.append(child)
+        level = next_level
+    for box in level:
+        for i in range(fanout):
+            box.add(Phone() if i % 2 else Headphones())
+    return root, level
+
+
+def walk_price(component: OrderComponent):
+    """Цена без кэша - полный обход поддерева."""
+    if isinstance(component, BoxContainer):
+        return sum(walk_price(child) for child in component._children)
+    return component.price
+
+
+def bench_cached_price(updates=100):
+    """Сравнивает чтение цены корня после точечных изменений: с кэшем и полным обходом."""
+    root, boxes = build_tree()
+    rnd = random.Random(0)
+    # Первый полный подсчет заполняет кэши и в замер не входит.
+    root.price
+
+    start = time.perf_counter()
+    for _ in range(updates):
+        rnd.choice(boxes).add(Phone())
+        root.price
+    cached = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(updates // 10):
+        rnd.choice(boxes).add(Phone())
+        walk_price(root)
+    walked = (time.perf_counter() - start) * 10
+
+    assert abs(root.price - walk_price(root)) < 1e-6
+    print('cached price: {0} изменений - кэш {1:.4f} c, полный обход {2:.2f} c'.format(updates, cached, walked))
+
+
+def bench_children(leaves=10 ** 4, reads=100):
+    """Сравнивает чтение children (снимок-кортеж) с прежним deepcopy списка детей."""
+    box = BoxContainer()
+    for i in range(leaves):
+        box.add(Phone() if i % 2 else Headphones())
+
+    for title, read in (('deepcopy', lambda: deepcopy(list(box._children))), ('children', lambda: box.children)):
+        start = time.perf_counter()
+        for _ in range(reads):
+            read()
+        elapsed = time.perf_counter() - start
+        print('children: {0} - {1:.3f} мс на чтение'.format(title, elapsed / reads * 1000))
+
+
+def build_chain(depth=10 ** 6):
+    """Строит цепочку вложенных коробок с телефоном в самой глубокой."""
+    root = box = BoxContainer()
+    for _ in range(depth - 1):
+        child = BoxContainer()
+        box.add(child)
+        box = child
+    box.add(Phone())
+    return root
+
+
+def bench_traversal(size=10 ** 6):
+    """Считает цену широкого и глубокого дерева без кэша и проверяет обходы."""
+    wide = BoxContainer()
+    for i in range(size):
+        wide.add(Phone() if i % 2 else Headphones())
+    deep = build_chain(size)
+
+    for title, root in (('широкое', wide), ('глубокое', deep)):
+        try:
+            start = time.perf_counter()
+            walk_price(root)
+            walked = '{0:.3f} c'.format(time.perf_counter() - start)
+        except RecursionError:
+            walked = 'RecursionError'
+
+        start = time.perf_counter()
+        root.price
+        folded = time.perf_counter() - start
+
+        start = time.perf_counter()
+        nodes = sum(1 for _ in iter_preorder(root))
+        assert nodes == sum(1 for _ in iter_breadth_first(root))
+        print('traversal: {0} ({1} узлов) - fold {2:.3f} c, рекурсия {3}, обход {4:.3f} c'.format(
+            title, nodes, folded, walked, time.perf_counter() - start,
+        ))
+
+
+def bench_flat_batch(orders=10 ** 4):
+    """Сравнивает пакетный подсчет цен объектных деревьев и FlatOrder."""
+    roots = [build_tree(fanout=4, depth=4)[0] for _ in range(orders)]
+
+    start = time.perf_counter()
+    flat = FlatOrder.from_components(*roots)
+    exported = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [root.price for root in roots]
+    walked = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prices = flat.root_prices()
+    flattened = time.perf_counter() - start
+
+    assert all(abs(a - b) < 1e-6 for a, b in zip(expected, prices))
+    # Выигрыш есть, только если деревья уже хранятся в плоском виде: экспорт
+    # из объектов сам по себе обходит все узлы и дороже обхода для цены.
+    print('flat: {0} заказов ({1} узлов) - объекты {2:.3f} c, FlatOrder {3:.3f} c (x{4:.0f}), '
+          'с экспортом из объектов {5:.3f} c (x{6:.2f})'.format(
+              orders, len(flat), walked, flattened, walked / flattened,
+              exported + flattened, walked / (exported + flattened),
+          ))
+
+
+def bench_parallel_price(fanout=10, depth=7, max_size=10 ** 5):
+    """Замеряет стоимость разбиения и ускорение параллельного подсчета по числу ядер."""
+    root, _ = build_tree(fanout, depth)
+    flat = FlatOrder.from_components(root)
+    del root
+
+    start = time.perf_counter()
+    rest, parts = flat.partition(max_size=max_size)
+    print('parallel: {0} узлов, {1} частей, разбиение {2:.4f} c'.format(
+        len(flat), len(parts), time.perf_counter() - start,
+    ))
+
+    start = time.perf_counter()
+    expected = flat.price()
+    serial = time.perf_counter() - start
+    print('parallel: последовательно {0:.3f} c'.format(serial))
+
+    resource_tracker.ensure_running()
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ProcessPoolExecutor(workers) as pool:
+            pool.submit(int).result()
+            start = time.perf_counter()
+            price = flat.parallel_price(max_size=max_size, executor=pool)
+            elapsed = time.perf_counter() - start
+        # Сумма по частям складывается в другом порядке, поэтому сравнение
+        # с относительной погрешностью.
+        assert math.isclose(price, expected, rel_tol=1e-9)
+        print('parallel: {0} процессов - {1:.3f} c (x{2:.2f})'.format(workers, elapsed, serial / elapsed))
+        workers *= 2
+
+
+def bench_diff_and_dedup(orders=100):
+    """Сравнивает ревизии по хэшам и замеряет экономию памяти пула поддеревьев."""
+    old, _ = build_tree()
+    new, boxes = build_tree()
+    old.structural_hash, new.structural_hash
+    boxes[len(boxes) // 2].add(Phone())
+
+    start = time.perf_counter()
+    changes = diff(old, new)
+    print('diff: {0} изменений за {1:.4f} c'.format(len(changes), time.perf_counter() - start))
+
+    pool = SubtreePool()
+    for shared in (False, True):
+        tracemalloc.start()
+        roots = [build_tree(fanout=4, depth=4)[0] for _ in range(orders)]
+        if shared:
+            roots = [pool.intern(root) for root in roots]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('dedup: пул={0} - {1:.1f} МБ на {2} заказов'.format(shared, size / 2 ** 20, orders))
+        del roots
+
+
+def bench_remove(children=10 ** 5):
+    """Удаляет все элементы из коробки со множеством детей."""
+    box = BoxContainer()
+    items = [Phone() if i % 2 else Headphones() for i in range(children)]
+    for item in items:
+        box.add(item)
+
+    rnd = random.Random(0)
+    rnd.shuffle(items)
+    start = time.perf_counter()
+    for item in items:
+        box.remove(item)
+    elapsed = time.perf_counter() - start
+
+    assert not box.children
+    print('remove: {0} удалений за {1:.3f} c'.format(children, elapsed))
+
+
+def to_json(root: OrderComponent) -> str:
+    return json.dumps(fold(root, lambda leaf: type(leaf).__name__, lambda box, children: children))
+
+
+def from_json(data: str) -> OrderComponent:
+    classes = {'Phone': Phone, 'Headphones': Headphones}
+    root = BoxContainer()
+    stack = [(root, json.loads(data))]
+    while stack:
+        box, children = stack.pop()
+        for child in children:
+            if isinstance(child, list):
+                component = BoxContainer()
+                stack.append((component, child))
+            else:
+                component = classes[child]()
+            box.add(component)
+    return root
+
+
+def bench_serialization(fanout=10, depth=6):
+    """Сравнивает размер и скорость бинарной сериализации с pickle и JSON."""
+    root, _ = build_tree(fanout, depth)
+    expected = root.price
+
+    def dump_binary(component):
+        buffer = BytesIO()
+        dump(component, buffer)
+        return buffer.getvalue()
+
+    formats = (
+        ('binary', dump_binary, lambda data: load(BytesIO(data))),
+        ('pickle', pickle.dumps, pickle.loads),
+        ('json', to_json, from_json),
+    )
+    for title, encode, decode in formats:
+        start = time.perf_counter()
+        data = encode(root)
+        encoded = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = decode(data)
+        elapsed = time.perf_counter() - start
+        assert abs(decoded.price - expected) < 1e-3
+        print('serialization: {0} - {1:.1f} МБ, запись {2:.2f} c, чтение {3:.2f} c'.format(
+            title, len(data) / 2 ** 20, encoded, elapsed,
+        ))
+        del decoded
+
+    data = dump_binary(root)
+    start = time.perf_counter()
+    lazy = loads(data, lazy=True)
+    lazy.children[0].children[0].price
+    print('serialization: ленивое чтение одного поддерева {0:.4f} c'.format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    bench_cached_price()
+    bench_children()
+    bench_traversal()
+    bench_flat_batch()
+    bench_parallel_price()
+    bench_diff_and_dedup()
+    bench_remove()
+    bench_serialization()
@@ -1,6 +1,19 @@
+import struct
+import sys
 from abc import ABC, abstractmethod
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from copy import deepcopy
-from typing import List
+from hashlib import blake2b
+from io import BytesIO
+from itertools import accumulate, repeat
+from multiprocessing.shared_memory import SharedMemory
+from operator import add, sub
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar, Union
+from weakref import WeakValueDictionary, ref
+
+T = TypeVar('T')
 
 
 class OrderComponent(ABC):
@@ -8,14 +21,74 @@ class OrderComponent(ABC):
     Базовый класс Компонент.
 
     Объявляет общие операции (в данном случае - свойство получении цены)
-    как для простых, так и для сложных структур данных
+    как для простых, так и для сложных структур данных.
+
+    Изменяемые коробки хранят слабые ссылки на родительские контейнеры,
+    чтобы изменения в поддереве могли сбросить закэшированные суммы и хэши
+    у предков. Одна коробка может лежать сразу в нескольких других. Листья
+    и общие коробки пула не меняются и кэшей не сбрасывают, поэтому ссылок
+    на родителей не хранят.
     """
+    _parent: Optional['ref[BoxContainer]'] = None
+    # Остальные родители по id; словарь создается, только если их больше одного.
+    _other_parents: Optional['WeakValueDictionary[int, BoxContainer]'] = None
+    _leaf_hashes: Dict[type, bytes] = {}
+
+    @property
+    def parent(self) -> Optional['BoxContainer']:
+        """Родительская коробка; если их несколько - первая из parents."""
+        parents = self.parents
+        return parents[0] if parents else None
+
+    @property
+    def parents(self) -> Tuple['BoxContainer', ...]:
+        first = self._parent() if self._parent is not None else None
+        parents = [first] if first is not None else []
+        if self._other_parents:
+            parents.extend(self._other_parents.values())
+        return tuple(parents)
+
+    def _link(self, box: 'BoxContainer'):
+        """Запоминает box как родителя. Листья родителей не хранят."""
+
+    def _unlink(self, box: 'BoxContainer'):
+        """Забывает родителя box."""
 
     @property
     @abstractmethod
     def price(self):
         pass
 
+    @property
+    def structural_hash(self) -> bytes:
+        """
+        Структурный хэш компонента.
+
+        Одинаковые по устройству поддеревья имеют одинаковый хэш. Простой
+        компонент не имеет своего состояния, поэтому его хэш зависит только
+        от класса.
+        """
+        cls = type(self)
+        digest = self._leaf_hashes.get(cls)
+        if digest is None:
+            name = '{0}.{1}'.format(cls.__module__, cls.__qualname__)
+            digest = self._leaf_hashes[cls] = blake2b(name.encode('utf-8'), digest_size=16).digest()
+        return digest
+
+    def __getstate__(self):
+        # Слабые ссылки на родителей сериализовать нельзя, родитель
+        # восстанавливает их сам в BoxContainer.__setstate__.
+        state = self.__dict__.copy()
+        state.pop('_parent', None)
+        state.pop('_other_parents', None)
+        return state
+
+    def deep_copy(self) -> 'OrderComponent':
+        """Возвращает независимую копию компонента без родителя."""
+        component = deepcopy(self)
+        component._parent = component._other_parents = None
+        return component
+
 
 class Phone(OrderComponent):
     """
@@ -37,6 +110,70 @@ class Headphones(OrderComponent):
         return 59.99
 
 
+class OrderedChildren:
+    """
+    Упорядоченный набор дочерних компонентов коробки.
+
+    Каждое вхождение компонента занимает свой слот в словаре: словарь
+    сохраняет порядок вставки, а добавление, удаление и проверка вхождения
+    выполняются за O(1) без сравнений через __eq__. Для каждого объекта
+    хранятся номера его слотов, поэтому, как и в списке, один объект может
+    входить несколько раз; remove удаляет первое вхождение.
+    """
+    __slots__ = ('_items', '_slots', '_next_slot')
+
+    def __init__(self, items: Iterable[OrderComponent] = ()):
+        self._items: Dict[int, OrderComponent] = {}
+        # id объекта -> номер его слота или очередь номеров, если объект повторяется.
+        self._slots: Dict[int, Union[int, deque]] = {}
+        self._next_slot = 0
+        for item in items:
+            self.add(item)
+
+    def add(self, element: OrderComponent):
+        slot = self._next_slot
+        self._next_slot += 1
+        self._items[slot] = element
+        key = id(element)
+        slots = self._slots.get(key)
+        if slots is None:
+            self._slots[key] = slot
+        elif isinstance(slots, int):
+            self._slots[key] = deque((slots, slot))
+        else:
+            slots.append(slot)
+
+    def remove(self, element: OrderComponent):
+        key = id(element)
+        slots = self._slots.get(key)
+        if slots is None:
+            raise ValueError('Компонента нет в этой коробке')
+        if isinstance(slots, int):
+            del self._slots[key]
+            slot = slots
+        else:
+            slot = slots.popleft()
+            if len(slots) == 1:
+                self._slots[key] = slots[0]
+        del self._items[slot]
+
+    def __contains__(self, element):
+        return id(element) in self._slots
+
+    def __iter__(self) -> Iterator[OrderComponent]:
+        return iter(self._items.values())
+
+    def __reversed__(self) -> Iterator[OrderComponent]:
+        return reversed(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+    def __reduce__(self):
+        # Ключи словаря слотов - id объектов, после копирования они другие.
+        return type(self), (list(self),)
+
+
 class BoxContainer(OrderComponent):
     """
     Класс коробки.
@@ -44,37 +181,690 @@ class BoxContainer(OrderComponent):
     Является сложным компонентом, т.к содержит ссылки на дочерние компоненты (как простые, так и сложные).
     Обычно объекты контейнера делегируют фактическую работу своим детям, а затем суммируют результат.
     """
+    # Префикс структурного хэша. Наследуется подклассами, которые отличаются
+    # только способом хранения (например, LazyBoxContainer).
+    _hash_prefix = b'BoxContainer'
 
     def __init__(self):
-        self._children: List[OrderComponent] = []
+        self._children: Union[OrderedChildren, Tuple[OrderComponent, ...]] = OrderedChildren()
+        self._price: Optional[float] = None
+        self._hash: Optional[bytes] = None
+        self._frozen = False
 
     """
     Объект контейнера может как добавлять компоненты в свой список вложенных
     компонентов, так и удалять их, как простые, так и сложные.
     """
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for child in self._children:
+            child._link(self)
+
+    def _link(self, box: 'BoxContainer'):
+        if self._frozen:
+            return
+        if self._parent is None or self._parent() is None:
+            self._parent = ref(box)
+        elif self._parent() is not box:
+            if self._other_parents is None:
+                self._other_parents = WeakValueDictionary()
+            self._other_parents[id(box)] = box
+
+    def _unlink(self, box: 'BoxContainer'):
+        if self._parent is not None and self._parent() is box:
+            self._parent = None
+            if self._other_parents:
+                # Первым родителем становится любой из остальных.
+                _, first = self._other_parents.popitem()
+                self._parent = ref(first)
+        elif self._other_parents:
+            self._other_parents.pop(id(box), None)
+        if not self._other_parents:
+            self._other_parents = None
+
+    def _check_mutable(self):
+        if self._frozen:
+            raise TypeError('Коробка из пула поддеревьев общая для нескольких заказов и не изменяется')
+
     def add(self, element: OrderComponent):
-        self._children.append(element)
+        self._check_mutable()
+        self._children.add(element)
+        element._link(self)
+        self._invalidate()
 
     def remove(self, element: OrderComponent):
+        self._check_mutable()
         self._children.remove(element)
+        if element not in self._children:
+            element._unlink(self)
+        self._invalidate()
+
+    def _invalidate(self):
+        """
+        Сбрасывает закэшированные сумму и хэш у контейнера и всех его предков.
+
+        Если сумма (или хэш) предка закэширована, то закэшированы и суммы
+        всех его потомков, поэтому подъем по каждому пути можно остановить
+        на первом контейнере без кэшей - выше кэшей тоже нет.
+        """
+        stack = [self]
+        while stack:
+            box = stack.pop()
+            if box._price is not None or box._hash is not None:
+                box._price = None
+                box._hash = None
+                stack.extend(box.parents)
+
+    def __contains__(self, element):
+        return element in self._children
 
     @property
-    def children(self):
-        return deepcopy(self._children)
+    def children(self) -> Tuple[OrderComponent, ...]:
+        """
+        Снимок дочерних компонентов только для чтения.
+
+        Кортеж нельзя изменить в обход add/remove, поэтому кэши остаются
+        согласованными, а само поддерево не копируется. Если нужна
+        независимая копия, используйте deep_copy().
+        """
+        return tuple(self._children)
+
+    def deep_copy(self) -> 'BoxContainer':
+        def copy_box(box: BoxContainer, children: List[OrderComponent]) -> BoxContainer:
+            box_copy = type(box)()
+            for child in children:
+                box_copy.add(child)
+            box_copy._price = box._price
+            return box_copy
+
+        return fold(self, lambda component: component.deep_copy(), copy_box)
 
     @property
     def price(self):
         """
         Контейнер выполняет свою основную логику особым образом. Он проходит
-        рекурсивно через всех своих детей, собирая и суммируя их результаты.
-        Поскольку потомки контейнера передают эти вызовы своим потомкам и так
-        далее, в результате обходится всё дерево объектов.
+        через всех своих детей, собирая и суммируя их результаты. Поскольку
+        потомки контейнера передают эти вызовы своим потомкам и так далее, в
+        результате обходится всё дерево объектов.
+
+        Обход выполняется через fold() с явным стеком, поэтому глубина
+        вложенности коробок не ограничена глубиной рекурсии. Результат
+        кэшируется до следующего изменения поддерева, а коробки с уже
+        посчитанной суммой при обходе не раскрываются.
         """
-        total = 0
-        for child in self._children:
-            total += child.price
-        return total
+        if self._price is None:
+            fold(self, _component_price, _cache_box_price, descend=_has_stale_price)
+        return self._price
+
+    @property
+    def structural_hash(self) -> bytes:
+        """
+        Хэш Меркла поддерева: хэш класса коробки и хэшей детей по порядку.
+
+        Кэшируется так же, как цена, и сбрасывается только на пути от
+        измененной коробки к корню.
+        """
+        if self._hash is None:
+            fold(self, _component_hash, _cache_box_hash, descend=_has_stale_hash)
+        return self._hash
+
+
+def _component_price(component: OrderComponent) -> float:
+    return component.price
+
+
+def _cache_box_price(box: BoxContainer, prices: List[float]) -> float:
+    total = 0
+    for price in prices:
+        total += price
+    box._price = total
+    return total
+
+
+def _has_stale_price(box: BoxContainer) -> bool:
+    return box._price is None
+
+
+def _component_hash(component: OrderComponent) -> bytes:
+    return component.structural_hash
+
+
+def _cache_box_hash(box: BoxContainer, hashes: List[bytes]) -> bytes:
+    digest = blake2b(box._hash_prefix, digest_size=16)
+    for child_hash in hashes:
+        digest.update(child_hash)
+    box._hash = digest.digest()
+    return box._hash
+
+
+def _has_stale_hash(box: BoxContainer) -> bool:
+    return box._hash is None
+
+
+def _children_of(component: OrderComponent) -> Sequence[OrderComponent]:
+    return component._children if isinstance(component, BoxContainer) else ()
+
+
+"""
+Обход дерева компонентов без рекурсии.
+
+Все функции используют явный стек (или очередь), поэтому работают с
+деревьями любой глубины и не тратят время на создание кадров стека вызовов.
+"""
+
+
+def iter_preorder(root: OrderComponent) -> Iterator[OrderComponent]:
+    """Прямой обход: контейнер перед своими детьми."""
+    stack = [root]
+    while stack:
+        component = stack.pop()
+        yield component
+        stack.extend(reversed(_children_of(component)))
+
+
+def iter_postorder(
+        root: OrderComponent, descend: Optional[Callable[[BoxContainer], bool]] = None,
+) -> Iterator[OrderComponent]:
+    """
+    Обратный обход: контейнер после всех своих детей.
+
+    Если задан descend, то контейнеры, для которых он вернул False, не
+    раскрываются и возвращаются как листья.
+    """
+    stack = [(root, False)]
+    while stack:
+        component, expanded = stack.pop()
+        if expanded or not isinstance(component, BoxContainer) or (descend is not None and not descend(component)):
+            yield component
+        else:
+            stack.append((component, True))
+            stack.extend((child, False) for child in reversed(component._children))
+
+
+def iter_breadth_first(root: OrderComponent) -> Iterator[OrderComponent]:
+    """Обход в ширину: по уровням дерева."""
+    queue = deque([root])
+    while queue:
+        component = queue.popleft()
+        yield component
+        queue.extend(_children_of(component))
+
+
+def fold(
+        root: OrderComponent,
+        leaf: Callable[[OrderComponent], T],
+        combine: Callable[[BoxContainer, List[T]], T],
+        descend: Optional[Callable[[BoxContainer], bool]] = None,
+) -> T:
+    """
+    Сворачивает дерево в одно значение.
+
+    Для каждого листа вызывается leaf, для каждого контейнера - combine со
+    списком значений его детей в исходном порядке. Контейнеры, которые не
+    раскрываются (см. descend у iter_postorder), обрабатываются как листья.
+    """
+    if not isinstance(root, BoxContainer) or (descend is not None and not descend(root)):
+        return leaf(root)
+
+    # Каждый кадр стека - контейнер, итератор по его детям и значения уже
+    # обработанных детей. Листья сворачиваются сразу, без отдельного кадра.
+    stack = [(root, iter(root._children), [])]
+    while True:
+        box, children, values = stack[-1]
+        for child in children:
+            if isinstance(child, BoxContainer) and (descend is None or descend(child)):
+                stack.append((child, iter(child._children), []))
+                break
+            values.append(leaf(child))
+        else:
+            stack.pop()
+            value = combine(box, values)
+            if not stack:
+                return value
+            stack[-1][2].append(value)
+
+
+class FlatOrder:
+    """
+    Плоское представление деревьев заказа для пакетной обработки.
+
+    Узлы хранятся в прямом порядке обхода в типизированных массивах: индекс
+    родителя (-1 у корня), размер поддерева, цена (0 у контейнеров) и номер
+    класса узла в таблице types. Поддерево узла i занимает отрезок
+    [i, i + sizes[i]), поэтому его цена - это сумма отрезка массива цен,
+    которая считается встроенной функцией sum без обхода объектов.
+    В одном FlatOrder можно хранить сразу много деревьев.
+
+    Выигрыш в скорости есть, когда деревья уже хранятся в плоском виде:
+    from_components сам обходит все объекты и обходится дороже, чем подсчет
+    цены по объектному дереву.
+    """
+
+    def __init__(self):
+        self.parents = array('q')
+        self.sizes = array('q')
+        self.prices = array('d')
+        self.type_ids = array('H')
+        self.types: List[Type[OrderComponent]] = []
+        self.roots = array('q')
+        self._type_index: Dict[Type[OrderComponent], int] = {}
+
+    def __len__(self):
+        return len(self.parents)
+
+    @classmethod
+    def from_components(cls, *roots: OrderComponent) -> 'FlatOrder':
+        flat = cls()
+        for root in roots:
+            flat.append(root)
+        return flat
+
+    def _type_id(self, component_type: Type[OrderComponent]) -> int:
+        type_id = self._type_index.get(component_type)
+        if type_id is None:
+            type_id = self._type_index[component_type] = len(self.types)
+            self.types.append(component_type)
+        return type_id
+
+    def append(self, root: OrderComponent) -> int:
+        """Добавляет дерево и возвращает индекс его корня."""
+        start = len(self.parents)
+        stack = [(root, -1)]
+        while stack:
+            component, parent = stack.pop()
+            index = len(self.parents)
+            self.parents.append(parent)
+            self.sizes.append(1)
+            self.type_ids.append(self._type_id(type(component)))
+            if isinstance(component, BoxContainer):
+                self.prices.append(0.0)
+                stack.extend((child, index) for child in reversed(component._children))
+            else:
+                self.prices.append(component.price)
+
+        parents, sizes = self.parents, self.sizes
+        for index in range(len(parents) - 1, start, -1):
+            sizes[parents[index]] += sizes[index]
+
+        self.roots.append(start)
+        return start
+
+    def price(self, index: int = 0) -> float:
+        """Цена поддерева с корнем в узле index."""
+        return sum(self.prices[index:index + self.sizes[index]])
+
+    def root_prices(self) -> List[float]:
+        """Цены всех деревьев, в порядке добавления."""
+        prices, sizes = self.prices, self.sizes
+        return [sum(prices[root:root + sizes[root]]) for root in self.roots]
+
+    def partition(self, index: int = 0, max_size: int = 10 ** 5) -> Tuple[float, List[Tuple[int, int]]]:
+        """
+        Разбивает поддерево на независимые поддеревья размером не больше max_size.
+
+        Возвращает цену узлов, не попавших ни в одно поддерево (контейнеры
+        верхних уровней), и список отрезков [start, stop) массива цен. Каждый
+        отрезок - это одно или несколько соседних целых поддеревьев в прямом
+        порядке обхода: небольшие соседние поддеревья объединяются в отрезки
+        до max_size узлов, чтобы у большой коробки с множеством листьев
+        не получалось по части на лист.
+        """
+        sizes, prices = self.sizes, self.prices
+        rest = 0.0
+        parts = []
+        stack = [index]
+        while stack:
+            node = stack.pop()
+            size = sizes[node]
+            if size <= max_size:
+                parts.append((node, node + size))
+                continue
+            rest += prices[node]
+            # Отрезок [run_start, run_stop) из подряд идущих небольших детей.
+            run_start = run_stop = child = node + 1
+            while child < node + size:
+                child_size = sizes[child]
+                if child_size > max_size:
+                    if run_start < run_stop:
+                        parts.append((run_start, run_stop))
+                    stack.append(child)
+                    run_start = run_stop = child + child_size
+                else:
+                    if child + child_size - run_start > max_size:
+                        parts.append((run_start, run_stop))
+                        run_start = child
+                    run_stop = child + child_size
+                child += child_size
+            if run_start < run_stop:
+                parts.append((run_start, run_stop))
+        return rest, parts
+
+    def parallel_price(self, index: int = 0, workers: Optional[int] = None, max_size: int = 10 ** 5,
+                       executor: Optional[Executor] = None) -> float:
+        """
+        Цена поддерева, посчитанная параллельно по независимым частям.
+
+        Части считаются в пуле процессов, а на сборках Python без GIL - в пуле
+        потоков. Процессам массив цен передается один раз через разделяемую
+        память, а в задачах уходят только границы частей. Небольшие деревья
+        (не больше max_size узлов) считаются в текущем потоке.
+
+        Пул процессов, переданный в executor, до Python 3.13 нужно создавать
+        после resource_tracker.ensure_running(): иначе каждый процесс пула
+        запустит свой трекер ресурсов, и тот при выходе сообщит об утечке
+        уже удаленного сегмента.
+        """
+        if self.sizes[index] <= max_size:
+            return self.price(index)
+
+        rest, parts = self.partition(index, max_size)
+        gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+        if executor is None and not gil_enabled:
+            prices = memoryview(self.prices)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return rest + sum(pool.map(lambda part: sum(prices[part[0]:part[1]]), parts))
+
+        shm = SharedMemory(create=True, size=max(len(self.prices) * self.prices.itemsize, 1))
+        try:
+            shm.buf[:len(self.prices) * self.prices.itemsize] = memoryview(self.prices).cast('B')
+            starts, stops = zip(*parts)
+            if executor is not None:
+                return rest + sum(executor.map(_sum_shared_prices, repeat(shm.name), starts, stops))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return rest + sum(pool.map(_sum_shared_prices, repeat(shm.name), starts, stops))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def subtree_totals(self) -> array:
+        """
+        Цены поддеревьев всех узлов.
+
+        Поддерево узла i - отрезок [i, i + sizes[i]), поэтому его цена - это
+        разность префиксных сумм массива цен. Префиксные суммы и разности
+        считаются через accumulate и map без цикла на Python и без массива
+        родителей. Для очень больших деревьев разность больших сумм может
+        терять младшие разряды.
+        """
+        # Список, а не array: индексирование списка не создает новых float.
+        prefix = list(accumulate(self.prices, initial=0.0))
+        ends = map(add, range(len(self.sizes)), self.sizes)
+        return array('d', map(sub, map(prefix.__getitem__, ends), prefix))
+
+    def to_component(self, index: int = 0) -> OrderComponent:
+        """Восстанавливает объектное дерево с корнем в узле index."""
+        nodes: Dict[int, OrderComponent] = {}
+        for i in range(index, index + self.sizes[index]):
+            component = self.types[self.type_ids[i]]()
+            nodes[i] = component
+            if i != index:
+                nodes[self.parents[i]].add(component)
+        return nodes[index]
+
+
+def _sum_shared_prices(name: str, start: int, stop: int) -> float:
+    """
+    Сумма отрезка [start, stop) массива цен FlatOrder из разделяемой памяти.
+
+    Сегментом владеет процесс, который его создал. До Python 3.13 подключение
+    регистрирует сегмент в трекере ресурсов, поэтому процессы пула должны
+    запускаться после его старта (см. FlatOrder.parallel_price).
+    """
+    if sys.version_info >= (3, 13):
+        shm = SharedMemory(name=name, track=False)
+    else:
+        shm = SharedMemory(name=name)
+    try:
+        with shm.buf.cast('d') as prices:
+            return sum(prices[start:stop])
+    finally:
+        shm.close()
+
+
+Change = namedtuple('Change', 'kind old new')
+
+
+def diff(old: OrderComponent, new: OrderComponent) -> List[Change]:
+    """
+    Находит различия между двумя ревизиями дерева заказа.
+
+    Поддеревья с одинаковыми хэшами пропускаются без обхода. У коробок с
+    разными хэшами дети с совпадающими хэшами считаются неизменными, а
+    остальные сопоставляются по порядку: пары коробок сравниваются дальше,
+    прочие пары попадают в результат как 'changed', лишние дети - как
+    'removed' или 'added'.
+    """
+    changes = []
+    stack = [(old, new)]
+    while stack:
+        old, new = stack.pop()
+        if old.structural_hash == new.structural_hash:
+            continue
+        if not (isinstance(old, BoxContainer) and isinstance(new, BoxContainer)):
+            changes.append(Change('changed', old, new))
+            continue
+
+        # Дети сопоставляются по числу вхождений каждого хэша, а не по
+        # объектам: после SubtreePool один объект может повторяться.
+        old_rest = _unmatched_children(old._children, new._children)
+        new_rest = _unmatched_children(new._children, old._children)
+
+        for old_child, new_child in zip(old_rest, new_rest):
+            stack.append((old_child, new_child))
+        changes.extend(Change('removed', child, None) for child in old_rest[len(new_rest):])
+        changes.extend(Change('added', None, child) for child in new_rest[len(old_rest):])
+    return changes
+
+
+def _unmatched_children(children: Iterable[OrderComponent], others: Iterable[OrderComponent]) -> List[OrderComponent]:
+    """Дети, для которых не нашлось пары с тем же хэшем среди others (с учетом повторов)."""
+    counts: Dict[bytes, int] = {}
+    for child in others:
+        counts[child.structural_hash] = counts.get(child.structural_hash, 0) + 1
+    rest = []
+    for child in children:
+        count = counts.get(child.structural_hash)
+        if count:
+            counts[child.structural_hash] = count - 1
+        else:
+            rest.append(child)
+    return rest
+
+
+class SubtreePool:
+    """
+    Пул одинаковых поддеревьев.
+
+    Заменяет в заказах одинаковые по хэшу компоненты одним общим
+    экземпляром, поэтому повторяющиеся коробки каталога хранятся в памяти
+    один раз. Общие коробки - это копии коробок исходного заказа, сам заказ
+    не меняется. Общие коробки неизменяемы: add/remove на них вызывают
+    TypeError, а для изменения нужно взять deep_copy(). Дети общей коробки
+    хранятся в кортеже и не ссылаются на неё как на родителя, т.к. один общий
+    компонент может входить в очень многие коробки.
+    """
+
+    def __init__(self):
+        self._components: Dict[bytes, OrderComponent] = {}
+
+    def __len__(self):
+        return len(self._components)
+
+    def _intern_leaf(self, component: OrderComponent) -> OrderComponent:
+        return self._components.setdefault(component.structural_hash, component)
+
+    def _intern_box(self, box: BoxContainer, children: List[OrderComponent]) -> OrderComponent:
+        shared = self._components.get(box.structural_hash)
+        if shared is None:
+            shared = type(box)()
+            shared._children = tuple(children)
+            shared._price, shared._hash = box._price, box._hash
+            shared._frozen = True
+            self._components[box.structural_hash] = shared
+        return shared
+
+    def intern(self, root: OrderComponent) -> OrderComponent:
+        """Возвращает дерево, в котором одинаковые поддеревья взяты из пула."""
+        root.structural_hash
+        return fold(root, self._intern_leaf, self._intern_box)
+
+
+"""
+Компактная бинарная сериализация деревьев заказа.
+
+Поток начинается с заголовка, за которым идут узлы в прямом порядке обхода.
+Лист - это один байт с тегом класса. Коробка - тег, число детей и длина всей
+записи поддерева в байтах, что позволяет пропускать поддеревья без разбора.
+"""
+ORDER_TAGS: Tuple[Type[OrderComponent], ...] = (BoxContainer, Phone, Headphones)
+_LEAF_TAGS = {cls: tag for tag, cls in enumerate(ORDER_TAGS) if cls is not BoxContainer}
+_BOX_TAG = ORDER_TAGS.index(BoxContainer)
+_STREAM_HEADER = struct.Struct('<4sB')
+_STREAM_MAGIC = b'ORDR'
+_STREAM_VERSION = 1
+_BOX_RECORD = struct.Struct('<BIQ')
+
+
+def dump(root: OrderComponent, fileobj: BinaryIO):
+    """
+    Записывает дерево в поток без промежуточной копии.
+
+    Длины записей коробок заранее считаются отдельным обходом (лист - один
+    байт, коробка - заголовок и записи детей), поэтому поток пишется строго
+    последовательно и может быть каналом или сокетом.
+    """
+    lengths: Dict[int, int] = {}
+
+    def box_length(box: BoxContainer, child_lengths: List[int]) -> int:
+        length = lengths[id(box)] = _BOX_RECORD.size + sum(child_lengths)
+        return length
+
+    fold(root, lambda component: 1, box_length)
+
+    fileobj.write(_STREAM_HEADER.pack(_STREAM_MAGIC, _STREAM_VERSION))
+    for component in iter_preorder(root):
+        if isinstance(component, BoxContainer):
+            fileobj.write(_BOX_RECORD.pack(_BOX_TAG, len(component._children), lengths[id(component)]))
+        else:
+            fileobj.write(bytes((_LEAF_TAGS[type(component)],)))
+
+
+def dumps(root: OrderComponent) -> bytes:
+    buffer = BytesIO()
+    dump(root, buffer)
+    return buffer.getvalue()
+
+
+def _check_stream_header(header: bytes):
+    if len(header) != _STREAM_HEADER.size:
+        raise ValueError('Поток заказа обрезан')
+    magic, version = _STREAM_HEADER.unpack(header)
+    if magic != _STREAM_MAGIC or version != _STREAM_VERSION:
+        raise ValueError('Неизвестный формат сериализованного заказа')
+
+
+def _leaf_class(tag: int) -> Type[OrderComponent]:
+    if tag == _BOX_TAG or tag >= len(ORDER_TAGS):
+        raise ValueError('Неизвестный тег узла заказа: {0}'.format(tag))
+    return ORDER_TAGS[tag]
+
+
+def load(fileobj: BinaryIO) -> OrderComponent:
+    """Последовательно читает дерево из потока."""
+    _check_stream_header(fileobj.read(_STREAM_HEADER.size))
+    root = None
+    stack: List[List] = []
+    while root is None or stack:
+        tag = fileobj.read(1)
+        if not tag:
+            raise ValueError('Поток заказа обрезан')
+        if tag[0] == _BOX_TAG:
+            record = tag + fileobj.read(_BOX_RECORD.size - 1)
+            if len(record) != _BOX_RECORD.size:
+                raise ValueError('Поток заказа обрезан')
+            _, count, _ = _BOX_RECORD.unpack(record)
+            component = BoxContainer()
+        else:
+            count, component = 0, _leaf_class(tag[0])()
+
+        if stack:
+            stack[-1][0].add(component)
+            stack[-1][1] -= 1
+        else:
+            root = component
+        if count:
+            stack.append([component, count])
+        while stack and not stack[-1][1]:
+            stack.pop()
+    return root
+
+
+def loads(data: bytes, lazy: bool = False) -> OrderComponent:
+    """
+    Читает дерево из байтов.
+
+    При lazy=True возвращается LazyBoxContainer: дети каждой коробки
+    декодируются только при первом обращении к ним.
+    """
+    if not lazy:
+        return load(BytesIO(data))
+
+    buffer = memoryview(data)
+    _check_stream_header(buffer[:_STREAM_HEADER.size])
+    return _decode_node(buffer, _STREAM_HEADER.size)[0]
+
+
+def _decode_node(buffer: memoryview, offset: int) -> Tuple[OrderComponent, int]:
+    """Возвращает узел по смещению и смещение следующей за его поддеревом записи."""
+    if offset >= len(buffer):
+        raise ValueError('Поток заказа обрезан')
+    tag = buffer[offset]
+    if tag == _BOX_TAG:
+        if offset + _BOX_RECORD.size > len(buffer):
+            raise ValueError('Поток заказа обрезан')
+        _, _, length = _BOX_RECORD.unpack_from(buffer, offset)
+        if length < _BOX_RECORD.size or offset + length > len(buffer):
+            raise ValueError('Поток заказа обрезан')
+        return LazyBoxContainer(buffer, offset), offset + length
+    return _leaf_class(tag)(), offset + 1
+
+
+class LazyBoxContainer(BoxContainer):
+    """
+    Коробка, прочитанная из сериализованного заказа.
+
+    Хранит ссылку на буфер и смещение своей записи. Дети декодируются при
+    первом обращении к ним, вложенные коробки при этом тоже ленивые, а их
+    поддеревья пропускаются по длине записи. Без буфера это обычная пустая
+    коробка: так её создают deep_copy, FlatOrder.to_component и SubtreePool.
+    """
+
+    def __init__(self, buffer: Optional[memoryview] = None, offset: int = 0):
+        super().__init__()
+        self._buffer: Optional[memoryview] = buffer
+        self._offset = offset
+
+    @property
+    def _children(self):
+        if self._buffer is not None:
+            buffer, self._buffer = self._buffer, None
+            _, count, _ = _BOX_RECORD.unpack_from(buffer, self._offset)
+            children = self.__dict__['_loaded_children']
+            offset = self._offset + _BOX_RECORD.size
+            for _ in range(count):
+                child, offset = _decode_node(buffer, offset)
+                children.add(child)
+                child._link(self)
+        return self.__dict__['_loaded_children']
+
+    @_children.setter
+    def _children(self, value):
+        self.__dict__['_loaded_children'] = value
+
+    def __getstate__(self):
+        self._children
+        return super().__getstate__()
 
 
 def client_code(component: OrderComponent):
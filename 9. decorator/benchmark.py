@@ -0,0 +1,193 @@
+"""
+Замеры производительности для примера паттерна Декоратор.
+
+Запуск из директории паттерна: python benchmark.py
+"""
+import asyncio
+import socket
+import time
+
+from example import BatchingNotificator, EmailNotificator, FacebookNotificator, SlackNotificator, SMSNotificator
+
+
+async def start_fake_server(delay: float, fail: bool = False):
+    """Локальный сервер канала: отвечает на строку через delay секунд или закрывает соединение."""
+    async def handle(reader, writer):
+        await reader.readline()
+        await asyncio.sleep(delay)
+        if not fail:
+            writer.write(b'ok\n')
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+class FakeServerChannel:
+    """Канал, который отправляет сообщение на локальный сервер вместо print."""
+    port = None
+
+    def deliver(self, message=''):
+        with socket.create_connection(('127.0.0.1', self.port)) as connection:
+            connection.sendall(message.encode('utf-8') + b'\n')
+            if connection.makefile('rb').readline() != b'ok\n':
+                raise ConnectionError('Канал не подтвердил отправку')
+
+    async def deliver_async(self, message=''):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        try:
+            writer.write(message.encode('utf-8') + b'\n')
+            await writer.drain()
+            if await reader.readline() != b'ok\n':
+                raise ConnectionError('Канал не подтвердил отправку')
+        finally:
+            writer.close()
+
+
+class FakeEmail(FakeServerChannel, EmailNotificator):
+    pass
+
+
+class FakeSMS(FakeServerChannel, SMSNotificator):
+    pass
+
+
+class FakeFacebook(FakeServerChannel, FacebookNotificator):
+    pass
+
+
+class FakeSlack(FakeServerChannel, SlackNotificator):
+    pass
+
+
+async def bench_concurrent_send():
+    """Сравнивает последовательную и одновременную отправку через каналы с задержками."""
+    delays = {FakeEmail: 0.1, FakeSMS: 0.2, FakeFacebook: 0.3, FakeSlack: 0.15}
+    servers = {cls: await start_fake_server(delay) for cls, delay in delays.items()}
+
+    def build():
+        notificator = FakeEmail()
+        for cls in (FakeSMS, FakeFacebook, FakeSlack):
+            notificator = cls(notificator)
+        for channel in notificator.channels():
+            channel.port = servers[type(channel)].sockets[0].getsockname()[1]
+        return notificator
+
+    notificator = build()
+    start = time.perf_counter()
+    await asyncio.to_thread(notificator.send, 'Hello, world!')
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    errors = await notificator.send_async('Hello, world!')
+    concurrent = time.perf_counter() - start
+    assert errors == [None] * 4
+    print('async: сумма задержек {0:.2f} c, последовательно {1:.2f} c, одновременно {2:.2f} c'.format(
+        sum(delays.values()), sequential, concurrent,
+    ))
+
+    # Таймаут и ошибка одного канала не мешают остальным.
+    broken = await start_fake_server(0, fail=True)
+    notificator = build()
+    channels = notificator.channels()
+    channels[1].port = broken.sockets[0].getsockname()[1]
+    channels[2].timeout = 0.05
+    errors = await notificator.send_async('Hello, world!')
+    print('async: ошибки каналов {0}'.format([type(error).__name__ if error else None for error in errors]))
+
+    # Даем серверу досрочно отключенного канала закончить ответ.
+    await asyncio.sleep(max(delays.values()))
+    for server in (*servers.values(), broken):
+        server.close()
+        await server.wait_closed()
+
+
+class QuietEmail(EmailNotificator):
+    def deliver(self, message=''):
+        pass
+
+
+class QuietSMS(SMSNotificator):
+    def deliver(self, message=''):
+        pass
+
+
+def build_stack(layers):
+    notificator = QuietEmail()
+    for _ in range(layers - 1):
+        notificator = QuietSMS(notificator)
+    return notificator
+
+
+def bench_compiled_stack(sends=10 ** 4):
+    """Сравнивает число отправок в секунду у стека декораторов и собранного стека."""
+    for layers in (1, 10, 100):
+        notificator = build_stack(layers)
+        for title, target in (('стек', notificator), ('собранный', notificator.compile())):
+            start = time.perf_counter()
+            for _ in range(sends):
+                target.send('Hello, world!')
+            elapsed = time.perf_counter() - start
+            print('compile: {0} слоев, {1} - {2:.0f} отправок/с'.format(layers, title, sends / elapsed))
+
+    notificator = build_stack(5000)
+    try:
+        notificator.send('Hello, world!')
+    except RecursionError:
+        print('compile: 5000 слоев, стек - RecursionError')
+    notificator.compile().send('Hello, world!')
+    print('compile: 5000 слоев, собранный - отправлено')
+
+
+class StubChannel(EmailNotificator):
+    """Канал-заглушка: каждый вызов стоит call_cost секунд, каждое сообщение - message_cost."""
+    call_cost = 0.001
+    message_cost = 0.00001
+
+    def __init__(self):
+        self.delivered = 0
+
+    def deliver(self, message=''):
+        self.deliver_many((message,))
+
+    def deliver_many(self, messages):
+        messages = list(messages)
+        time.sleep(self.call_cost + self.message_cost * len(messages))
+        self.delivered += len(messages)
+
+
+def bench_batching(messages=2000):
+    """Сравнивает пропускную способность отправки по одному и пачками."""
+    channel = StubChannel()
+    start = time.perf_counter()
+    for _ in range(messages):
+        channel.send('Hello, world!')
+    single = time.perf_counter() - start
+
+    channel = StubChannel()
+    start = time.perf_counter()
+    with BatchingNotificator(channel, batch_size=100, max_pending=500) as notificator:
+        for _ in range(messages):
+            notificator.send('Hello, world!')
+    batched = time.perf_counter() - start
+    assert channel.delivered == messages
+
+    # Во внешнем стеке, в том числе собранном, сообщения тоже идут через буфер.
+    channel = StubChannel()
+    with BatchingNotificator(channel, batch_size=100) as notificator:
+        stack = QuietSMS(notificator)
+        assert stack.channels() == [notificator, stack]
+        compiled = stack.compile()
+        for _ in range(100):
+            compiled.send('Hello, world!')
+        asyncio.run(stack.send_async('Hello, world!'))
+    assert channel.delivered == 101
+    print('batching: по одному {0:.0f} сообщений/с, пачками {1:.0f} сообщений/с'.format(
+        messages / single, messages / batched,
+    ))
+
+
+if __name__ == '__main__':
+    asyncio.run(bench_concurrent_send())
+    bench_compiled_stack()
+    bench_batching()
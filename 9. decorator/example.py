@@ -1,4 +1,9 @@
+import asyncio
 from abc import ABC, abstractmethod
+from threading import Condition, Lock, Thread
+from time import monotonic
+from typing import Callable, Iterable, List, Optional
+from weakref import finalize
 
 
 class Notificator(ABC):
@@ -6,12 +11,102 @@ class Notificator(ABC):
     Абстрактный класс оповещений.
 
     Базовый интерфейс Компонента определяет поведение, которое изменяется декораторами.
+
+    Каждый объект стека отвечает за один канал: deliver отправляет сообщение
+    только в него, а send - во все каналы стека по очереди. send_async
+    отправляет во все каналы стека одновременно.
     """
+    # Таймаут отправки в канал (в секундах) для send_async.
+    timeout: Optional[float] = None
 
     @abstractmethod
     def send(self, message=''):
         pass
 
+    def deliver(self, message=''):
+        """
+        Отправка только в канал этого объекта. По умолчанию канал - это сам
+        send: так компонент, реализующий только send, остается одним каналом.
+        """
+        self.send(message)
+
+    def deliver_many(self, messages: Iterable[str]):
+        """
+        Пакетная отправка в канал. По умолчанию - по одному deliver на
+        сообщение, каналы с пакетным API могут отправлять за один вызов.
+        """
+        for message in messages:
+            self.deliver(message)
+
+    async def deliver_async(self, message=''):
+        """
+        Асинхронная отправка в канал. По умолчанию синхронный deliver
+        выполняется в отдельном потоке, каналы с асинхронным клиентом
+        могут переопределить этот метод.
+        """
+        await asyncio.to_thread(self.deliver, message)
+
+    def channels(self) -> List['Notificator']:
+        """
+        Каналы стека в порядке отправки: от обернутого компонента к внешнему
+        декоратору. Декораторы без своего канала (не переопределившие
+        deliver базового декоратора) пропускаются.
+        """
+        channels = []
+        notificator = self
+        while isinstance(notificator, BaseNotifyDecorator):
+            if notificator._overrides_send():
+                # Свой send может менять отправку во весь обернутый стек,
+                # поэтому такой декоратор вместе со стеком - один канал.
+                if type(notificator).deliver is not BaseNotifyDecorator.deliver:
+                    raise TypeError(
+                        '{0} переопределяет и send, и deliver: порядок отправки '
+                        'по каналам не определен'.format(type(notificator).__name__)
+                    )
+                break
+            if type(notificator).deliver is not BaseNotifyDecorator.deliver:
+                channels.append(notificator)
+            notificator = notificator.component
+        channels.append(notificator)
+        channels.reverse()
+        return channels
+
+    async def send_async(self, message='', timeout: Optional[float] = None) -> List[Optional[BaseException]]:
+        """
+        Отправляет сообщение во все каналы стека одновременно.
+
+        Время отправки определяется самым медленным каналом, а не суммой
+        задержек. Ошибка или таймаут одного канала не мешают остальным:
+        возвращается список ошибок (None - успешно) в порядке channels().
+        Таймаут канала берется из его атрибута timeout, иначе из аргумента.
+        """
+        async def deliver(channel: Notificator):
+            channel_timeout = channel.timeout if channel.timeout is not None else timeout
+            if channel._overrides_send():
+                coroutine = asyncio.to_thread(channel.send, message)
+            else:
+                coroutine = channel.deliver_async(message)
+            await asyncio.wait_for(coroutine, channel_timeout)
+
+        channels = self.channels()
+        results = await asyncio.gather(*(deliver(channel) for channel in channels), return_exceptions=True)
+        return [result if isinstance(result, BaseException) else None for result in results]
+
+    def _overrides_send(self) -> bool:
+        """
+        True для декоратора со своим send: в channels() он - один канал вместе
+        с обернутым стеком, и отправлять в этот канал нужно через его send.
+        """
+        return False
+
+    def _channel_sender(self) -> Callable[[str], None]:
+        """Чем отправлять сообщение в этот объект как в канал из channels()."""
+        return self.send if self._overrides_send() else self.deliver
+
+    def compile(self) -> 'CompiledNotificator':
+        """Собирает стек декораторов в плоский список отправителей, см. CompiledNotificator."""
+        return CompiledNotificator(self)
+
 
 class EmailNotificator(Notificator):
     """
@@ -21,6 +116,9 @@ class EmailNotificator(Notificator):
     """
 
     def send(self, message=''):
+        self.deliver(message)
+
+    def deliver(self, message=''):
         print('Отправлено сообщение с тексом "{0}" по почте'.format(message))
 
 
@@ -42,38 +140,211 @@ class BaseNotifyDecorator(Notificator):
         return self._component
 
     def send(self, message=''):
-        """Декоратор делегирует всю работу обёрнутому компоненту."""
+        """
+        Декоратор делегирует работу обёрнутому компоненту, а затем отправляет
+        сообщение в свой канал. Конкретным декораторам достаточно
+        переопределить deliver.
+        """
         self.component.send(message)
+        self.deliver(message)
+
+    def deliver(self, message=''):
+        """Базовый декоратор не добавляет своего канала."""
+
+    def _overrides_send(self) -> bool:
+        return type(self).send is not BaseNotifyDecorator.send
 
 
 class SMSNotificator(BaseNotifyDecorator):
     """
     Конкретные Декораторы вызывают обёрнутый объект и изменяют его результат
     некоторым образом.
+
+    Декоратор использует родительскую реализацию send, вместо того, чтобы
+    вызвать обёрнутый объект напрямую, и добавляет только свой канал. Такой
+    подход упрощает расширение классов декораторов.
     """
 
-    def send(self, message=''):
-        """
-        Декораторы могут вызывать родительскую реализацию операции, вместо того,
-        чтобы вызвать обёрнутый объект напрямую. Такой подход упрощает
-        расширение классов декораторов.
-        """
-        super().send(message)
+    def deliver(self, message=''):
         print('Отправлено сообщение с тексом "{0}" по SMS'.format(message))
 
 
 class FacebookNotificator(BaseNotifyDecorator):
-    def send(self, message=''):
-        super().send(message)
+    def deliver(self, message=''):
         print('Отправлено сообщение с тексом "{0}" на Facebook'.format(message))
 
 
 class SlackNotificator(BaseNotifyDecorator):
-    def send(self, message=''):
-        super().send(message)
+    def deliver(self, message=''):
         print('Отправлено сообщение с тексом "{0}" на Slack'.format(message))
 
 
+class CompiledNotificator(Notificator):
+    """
+    Стек декораторов, собранный в плоский список.
+
+    Хранит отправителей всех каналов стека в порядке отправки и вызывает
+    их в одном цикле. Это убирает накладные расходы на вызовы super() и
+    обращения к component на каждом уровне и не упирается в ограничение
+    глубины рекурсии на очень глубоких стеках. Порядок совпадает с send
+    исходного стека: декоратор со своим send (например, BatchingNotificator)
+    вызывается через send целиком, вместе с обернутым им стеком, а стек с
+    декоратором, переопределившим и send, и deliver, не собирается (TypeError).
+    """
+
+    def __init__(self, notificator: Notificator):
+        self._channels = notificator.channels()
+        self._senders = [channel._channel_sender() for channel in self._channels]
+
+    def channels(self) -> List[Notificator]:
+        return list(self._channels)
+
+    def send(self, message=''):
+        for deliver in self._senders:
+            deliver(message)
+
+    def deliver(self, message=''):
+        self.send(message)
+
+
+class _MessageBatcher:
+    """
+    Буфер и фоновый поток BatchingNotificator.
+
+    Вынесены в отдельный объект, чтобы поток не держал сам декоратор:
+    брошенный декоратор собирается сборщиком мусора, а его буфер
+    отправляется и поток останавливается через weakref.finalize.
+    """
+
+    def __init__(self, component: Notificator, batch_size: int, flush_interval: float, max_pending: int):
+        self.component = component
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.last_error: Optional[Exception] = None
+        self._buffer: List[str] = []
+        self._closed = False
+        self._condition = Condition()
+        # Держится на время отправки пачки, чтобы пачки не обгоняли друг друга.
+        self._deliver_lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    def send(self, message: str):
+        with self._condition:
+            while len(self._buffer) >= self.max_pending and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                raise RuntimeError('Отправка через закрытый BatchingNotificator')
+            if self._thread is None:
+                # Поток запускается при первой отправке, а не при создании.
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._buffer.append(message)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+
+    def flush(self):
+        with self._deliver_lock:
+            with self._condition:
+                batch, self._buffer = self._buffer, []
+                self._condition.notify_all()
+            if batch:
+                self._deliver_batch(batch)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def _deliver_batch(self, batch: List[str]):
+        for channel in self.component.channels():
+            try:
+                if channel._overrides_send():
+                    for message in batch:
+                        channel.send(message)
+                else:
+                    channel.deliver_many(batch)
+            except Exception as error:
+                self.last_error = error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = monotonic() + self.flush_interval
+                while len(self._buffer) < self.batch_size and not self._closed:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+
+class BatchingNotificator(BaseNotifyDecorator):
+    """
+    Декоратор, который копит сообщения и отправляет их пачками.
+
+    send только кладет сообщение в буфер. Фоновый поток отдает накопленные
+    сообщения каналам обернутого стека через deliver_many, как только в
+    буфере набралось batch_size сообщений или прошло flush_interval секунд.
+    Если в буфере уже max_pending сообщений, send ждет, пока место
+    освободится. Ошибка канала не останавливает отправку: последняя ошибка
+    сохраняется в last_error.
+
+    Поток запускается при первой отправке. Если декоратор не закрыт явно,
+    остаток буфера отправляется, а поток останавливается, когда декоратор
+    собран сборщиком мусора или при завершении интерпретатора.
+
+    Внутри большего стека BatchingNotificator переопределяет send, поэтому
+    channels(), send_async и compile() видят его одним каналом вместе с
+    обернутыми каналами, и сообщения идут через буфер, а не мимо него.
+    """
+
+    def __init__(self, component: Notificator, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_pending: int = 10000):
+        super().__init__(component)
+        self._batcher = _MessageBatcher(component, batch_size, flush_interval, max_pending)
+        self._finalizer = finalize(self, self._batcher.close)
+
+    @property
+    def batch_size(self) -> int:
+        return self._batcher.batch_size
+
+    @property
+    def flush_interval(self) -> float:
+        return self._batcher.flush_interval
+
+    @property
+    def max_pending(self) -> int:
+        return self._batcher.max_pending
+
+    @property
+    def last_error(self) -> Optional[Exception]:
+        return self._batcher.last_error
+
+    def send(self, message=''):
+        self._batcher.send(message)
+
+    def flush(self):
+        """Синхронно отправляет все накопленные сообщения."""
+        self._batcher.flush()
+
+    def close(self):
+        """Останавливает фоновый поток и отправляет остаток буфера."""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def client_code(notificator: Notificator):
     """
     Клиентский код работает со всеми объектами, используя интерфейс Компонента.
@@ -95,3 +366,8 @@ if __name__ == '__main__':
     # Отправить сообщение по эл. почте, SMS и Facebook
     n3 = FacebookNotificator(n2)
     client_code(n3)
+
+    print('-' * 75)
+
+    # Отправить сообщение во все каналы одновременно
+    asyncio.run(n3.send_async('Hello, world!'))